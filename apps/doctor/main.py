@@ -1,9 +1,14 @@
+import threading
+import time
+
 import flet as ft
 import requests
 from datetime import date
 
 API_BASE = "http://127.0.0.1:10000/api"
 
+HISTORY_PAGE_SIZE = 20
+
 def main(page: ft.Page):
     page.title = "Hospital App"
     token = {"value": None}
@@ -12,6 +17,24 @@ def main(page: ft.Page):
     theme_mode = {"value": ft.ThemeMode.LIGHT}
     user_type = {"value": None}
     hospital_info = {"value": None}
+    # Catalog responses keyed by URL and params, revalidated with their ETag
+    catalog_cache = {}
+    # Bumped on login/logout so a stale change-feed thread stops
+    feed_generation = {"value": 0}
+
+    def get_catalog(url, params=None):
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = catalog_cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        r = requests.get(url, params=params, headers=headers)
+        if r.status_code == 304 and cached:
+            return 200, cached[1]
+        if r.status_code == 200:
+            data = r.json()
+            if r.headers.get("ETag"):
+                catalog_cache[key] = (r.headers["ETag"], data)
+            return 200, data
+        return r.status_code, None
 
     # Login components
     email = ft.TextField(label="Email")
@@ -53,9 +76,9 @@ def main(page: ft.Page):
     def handle_hospital_change(e):
         if signup_hospital_dropdown.value:
             try:
-                r = requests.get(f"{API_BASE}/hospitals")
-                if r.status_code == 200:
-                    hospitals = r.json().get("hospitals", [])
+                status, data = get_catalog(f"{API_BASE}/hospitals")
+                if status == 200:
+                    hospitals = data.get("hospitals", [])
                     selected_hospital = next((h for h in hospitals if str(h["hospital_id"]) == signup_hospital_dropdown.value), None)
                     if selected_hospital:
                         signup_hospital_location.value = selected_hospital["address"]
@@ -112,7 +135,7 @@ def main(page: ft.Page):
     stats_texts = {
         "appointments": ft.Text("Loading...", size=20, weight=ft.FontWeight.BOLD, color=ft.colors.BLUE),
         "completed": ft.Text("Loading...", size=20, weight=ft.FontWeight.BOLD, color=ft.colors.GREEN),
-        "reviews": ft.Text("0", size=20, weight=ft.FontWeight.BOLD, color=ft.colors.ORANGE),
+        "cancelled": ft.Text("Loading...", size=20, weight=ft.FontWeight.BOLD, color=ft.colors.ORANGE),
     }
 
     def do_login(e):
@@ -222,6 +245,35 @@ def main(page: ft.Page):
             )
         )
         show_home_view()
+        if user_type["value"] == "Doctor":
+            start_appointment_feed()
+
+    def start_appointment_feed():
+        feed_generation["value"] += 1
+        threading.Thread(target=follow_appointment_changes, args=(feed_generation["value"],), daemon=True).start()
+
+    def follow_appointment_changes(generation):
+        # Long-poll the change feed and refresh the visible view when a
+        # booking or status change arrives
+        since = None
+        while feed_generation["value"] == generation and token["value"]:
+            headers = {"Authorization": f"Bearer {token['value']}"}
+            params = {} if since is None else {"since": since, "wait": 30}
+            try:
+                r = requests.get(f"{API_BASE}/appointments/changes", params=params, headers=headers, timeout=40)
+            except requests.RequestException:
+                time.sleep(5)
+                continue
+            if r.status_code != 200:
+                time.sleep(5)
+                continue
+            data = r.json()
+            if since is not None and data.get("changes") and feed_generation["value"] == generation:
+                if current_view["value"] == "appointments":
+                    load_appointments()
+                elif current_view["value"] == "home":
+                    load_stats()
+            since = data.get("next", since)
 
     def change_view(index):
         content_area.opacity = 0
@@ -300,8 +352,8 @@ def main(page: ft.Page):
         stats_row = ft.Row([
             ft.Container(
                 content=ft.Column([
-                    ft.Icon(ft.icons.PEOPLE, size=32, color=ft.colors.BLUE_600),
-                    ft.Text("Total Doctors", size=14, color=ft.colors.GREY_600),
+                    ft.Icon(ft.icons.EVENT, size=32, color=ft.colors.BLUE_600),
+                    ft.Text("Upcoming Today", size=14, color=ft.colors.GREY_600),
                     stats_texts["appointments"],
                 ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=8),
                 width=110,
@@ -319,7 +371,7 @@ def main(page: ft.Page):
             ft.Container(
                 content=ft.Column([
                     ft.Icon(ft.icons.CHECK_CIRCLE, size=32, color=ft.colors.GREEN_600),
-                    ft.Text("Available Today", size=14, color=ft.colors.GREY_600),
+                    ft.Text("Completed Today", size=14, color=ft.colors.GREY_600),
                     stats_texts["completed"],
                 ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=8),
                 width=110,
@@ -336,9 +388,9 @@ def main(page: ft.Page):
             ),
             ft.Container(
                 content=ft.Column([
-                    ft.Icon(ft.icons.MEDICAL_SERVICES, size=32, color=ft.colors.PURPLE_600),
-                    ft.Text("Departments", size=14, color=ft.colors.GREY_600),
-                    stats_texts["reviews"],
+                    ft.Icon(ft.icons.CANCEL, size=32, color=ft.colors.ORANGE_600),
+                    ft.Text("Cancelled Today", size=14, color=ft.colors.GREY_600),
+                    stats_texts["cancelled"],
                 ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=8),
                 width=110,
                 height=100,
@@ -382,10 +434,16 @@ def main(page: ft.Page):
         page.update()
 
     def load_hospital_stats():
-        # Placeholder for hospital stats
-        stats_texts["appointments"].value = "0"
-        stats_texts["completed"].value = "0"
-        stats_texts["reviews"].value = "0"
+        if user_type["value"] == "Doctor":
+            load_stats()
+            return
+        # Today's appointment counts across the admin's hospital
+        headers = {"Authorization": f"Bearer {token['value']}"}
+        r = requests.get(f"{API_BASE}/hospital-admin/stats", headers=headers)
+        counts = r.json().get("counts", {}) if r.status_code == 200 else {}
+        stats_texts["appointments"].value = str(counts.get("Scheduled", 0) + counts.get("Confirmed", 0))
+        stats_texts["completed"].value = str(counts.get("Completed", 0))
+        stats_texts["cancelled"].value = str(counts.get("Cancelled", 0))
         page.update()
 
     def show_appointments_view():
@@ -719,6 +777,7 @@ def main(page: ft.Page):
         page.update()
 
     def logout(e):
+        feed_generation["value"] += 1
         token["value"] = None
         user_id["value"] = None
         page.clean()
@@ -729,61 +788,71 @@ def main(page: ft.Page):
         page.theme_mode = theme_mode["value"]
         page.update()
 
-    def load_stats():
+    def fetch_agenda():
+        # Today's appointments and per-status counts, precomputed by the server
         headers = {"Authorization": f"Bearer {token['value']}"}
-        r = requests.get(f"{API_BASE}/appointments/{user_id['value']}?today=true", headers=headers)
-        today_count = 0
-        completed_today = 0
-        if r.status_code == 200:
-            appointments = r.json().get("appointments", [])
-            today_count = len([a for a in appointments if a['status'] != 'Completed'])
-            completed_today = len([a for a in appointments if a['status'] == 'Completed'])
-        stats_texts["appointments"].value = str(today_count)
-        stats_texts["completed"].value = str(completed_today)
+        r = requests.get(f"{API_BASE}/appointments/{user_id['value']}/agenda", headers=headers)
+        return r.json() if r.status_code == 200 else None
+
+    def load_stats(agenda=None):
+        agenda = agenda or fetch_agenda()
+        counts = agenda.get("counts", {}) if agenda else {}
+        stats_texts["appointments"].value = str(counts.get("Scheduled", 0) + counts.get("Confirmed", 0))
+        stats_texts["completed"].value = str(counts.get("Completed", 0))
+        stats_texts["cancelled"].value = str(counts.get("Cancelled", 0))
         page.update()
 
-    def load_appointments():
+    def load_appointments(agenda=None):
         appt_list.controls.clear()
-        headers = {"Authorization": f"Bearer {token['value']}"}
-        # Add today=true parameter to get only today's appointments
-        r = requests.get(f"{API_BASE}/appointments/{user_id['value']}?today=true", headers=headers)
-        if r.status_code == 200:
-            appointments = r.json().get("appointments", [])
+        agenda = agenda or fetch_agenda()
+        if agenda:
+            # Only today's appointments that are not completed yet
+            appointments = [a for a in agenda.get("appointments", []) if a['status'] != 'Completed']
             if appointments:
+                open_ids = [a['appointment_id'] for a in appointments if a['status'] != 'Cancelled']
+                if len(open_ids) > 1:
+                    appt_list.controls.append(
+                        ft.ElevatedButton("Mark All Completed", on_click=lambda e, ids=open_ids: mark_completed(ids))
+                    )
                 for a in appointments:
-                    if a['status'] != 'Completed':
-                        status_color = ft.colors.BLUE if a['status'] == 'Scheduled' else ft.colors.ORANGE
-                        appt_list.controls.append(
-                            ft.Card(
-                                content=ft.Container(
-                                    content=ft.Column([
-                                        ft.Row([
-                                            ft.Icon(ft.icons.CALENDAR_TODAY, color=ft.colors.BLUE),
-                                            ft.Text(f"{a['date']} at {a['time']}", size=16, weight=ft.FontWeight.BOLD),
-                                        ]),
-                                        ft.Text(f"Status: {a['status']}", color=status_color),
-                                        ft.Text(f"Patient: {a.get('patient_name', 'Unknown')}", size=14),
-                                        ft.ElevatedButton("Mark Completed", on_click=lambda e, aid=a['id']: mark_completed(aid)),
-                                    ], spacing=5),
-                                    padding=15
-                                ),
-                                margin=ft.margin.symmetric(vertical=5)
-                            )
+                    status_color = ft.colors.BLUE if a['status'] == 'Scheduled' else ft.colors.ORANGE
+                    appt_list.controls.append(
+                        ft.Card(
+                            content=ft.Container(
+                                content=ft.Column([
+                                    ft.Row([
+                                        ft.Icon(ft.icons.CALENDAR_TODAY, color=ft.colors.BLUE),
+                                        ft.Text(f"{a['date']} at {a['time']}", size=16, weight=ft.FontWeight.BOLD),
+                                    ]),
+                                    ft.Text(f"Status: {a['status']}", color=status_color),
+                                    ft.Text(f"Patient: {a.get('patient_name', 'Unknown')}", size=14),
+                                    ft.ElevatedButton("Mark Completed", on_click=lambda e, aid=a['appointment_id']: mark_completed([aid])),
+                                ], spacing=5),
+                                padding=15
+                            ),
+                            margin=ft.margin.symmetric(vertical=5)
                         )
+                    )
             else:
                 appt_list.controls.append(ft.Text("No appointments scheduled for today", color=ft.colors.GREY))
         else:
             appt_list.controls.append(ft.Text("Failed to load appointments", color=ft.colors.RED))
         page.update()
 
-    def load_completed_appointments():
-        completed_appt_list.controls.clear()
+    def load_completed_appointments(cursor=None):
+        # Newest first, one page at a time; "Load more" fetches the next page
+        if cursor is None:
+            completed_appt_list.controls.clear()
+        elif completed_appt_list.controls:
+            completed_appt_list.controls.pop()  # the "Load more" button
         headers = {"Authorization": f"Bearer {token['value']}"}
-        # Get all appointments and filter for completed ones
-        r = requests.get(f"{API_BASE}/appointments/{user_id['value']}", headers=headers)
+        params = {"status": "Completed", "order": "desc", "limit": HISTORY_PAGE_SIZE}
+        if cursor:
+            params["cursor"] = cursor
+        r = requests.get(f"{API_BASE}/appointments/{user_id['value']}", params=params, headers=headers)
         if r.status_code == 200:
-            appointments = r.json().get("appointments", [])
-            completed_appts = [a for a in appointments if a['status'] == 'Completed']
+            completed_appts = r.json().get("appointments", [])
+            next_cursor = r.json().get("next_cursor")
             if completed_appts:
                 for a in completed_appts:
                     completed_appt_list.controls.append(
@@ -802,15 +871,36 @@ def main(page: ft.Page):
                             margin=ft.margin.symmetric(vertical=5)
                         )
                     )
-            else:
+                if next_cursor:
+                    completed_appt_list.controls.append(
+                        ft.TextButton("Load more", on_click=lambda e, c=next_cursor: load_completed_appointments(c))
+                    )
+            elif cursor is None:
                 completed_appt_list.controls.append(ft.Text("No completed appointments found", color=ft.colors.GREY))
         else:
             completed_appt_list.controls.append(ft.Text("Failed to load completed appointments", color=ft.colors.RED))
         page.update()
 
-    def mark_completed(aid):
-        # Placeholder: reload appointments (assuming API updates status)
-        load_appointments()
+    def mark_completed(aids):
+        # One request for any number of appointments
+        headers = {"Authorization": f"Bearer {token['value']}"}
+        r = requests.put(
+            f"{API_BASE}/appointments/status",
+            json={"updates": [{"appointment_id": aid, "status": "Completed"} for aid in aids]},
+            headers=headers,
+        )
+        error = None
+        if r.status_code == 200:
+            failed = [res for res in r.json().get("results", []) if res.get("status") != 200]
+            if failed:
+                error = f"{len(failed)} appointment(s) could not be updated"
+        else:
+            error = "Failed to update appointments"
+        agenda = fetch_agenda()
+        load_appointments(agenda)
+        if error:
+            appt_list.controls.insert(0, ft.Text(error, color=ft.colors.RED))
+        load_stats(agenda)
 
     def do_signup(e):
         try:
@@ -881,10 +971,10 @@ def main(page: ft.Page):
         try:
             # demo coordinates; replace with device location
             lat, lon = 18.5204, 73.8567
-            r = requests.get(f"{API_BASE}/hospitals/nearby", params={"lat": lat, "lon": lon})
+            status, data = get_catalog(f"{API_BASE}/hospitals/nearby", params={"lat": lat, "lon": lon})
             
-            if r.status_code == 200:
-                hospitals = r.json().get("hospitals", [])
+            if status == 200:
+                hospitals = data.get("hospitals", [])
                 hospitals_list.controls.clear()
                 
                 if hospitals:
@@ -910,7 +1000,7 @@ def main(page: ft.Page):
                     hospitals_list.controls.append(ft.Text("No hospitals found nearby", color=ft.colors.ORANGE))
             else:
                 hospitals_list.controls.clear()
-                hospitals_list.controls.append(ft.Text(f"Error loading hospitals: {r.status_code}", color=ft.colors.RED))
+                hospitals_list.controls.append(ft.Text(f"Error loading hospitals: {status}", color=ft.colors.RED))
         except Exception as ex:
             hospitals_list.controls.clear()
             hospitals_list.controls.append(ft.Text(f"Failed to load hospitals: {str(ex)}", color=ft.colors.RED))
@@ -1055,9 +1145,9 @@ def main(page: ft.Page):
 
     def load_hospitals_for_signup():
         try:
-            r = requests.get(f"{API_BASE}/hospitals")
-            if r.status_code == 200:
-                hospitals = r.json().get("hospitals", [])
+            status, data = get_catalog(f"{API_BASE}/hospitals")
+            if status == 200:
+                hospitals = data.get("hospitals", [])
                 signup_hospital_dropdown.options = [
                     ft.dropdown.Option(key=str(h["hospital_id"]), text=h["name"])
                     for h in hospitals
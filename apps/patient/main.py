@@ -1,12 +1,29 @@
 import flet as ft
 import requests
 import json
+import uuid
 from datetime import datetime
 
 # Update this with your Render URL after deployment
 API_BASE = "https://asupatri-backend.onrender.com/api"
 # For local development, use: API_BASE = "http://127.0.0.1:10000/api"
 
+# Every status except Completed, for the "upcoming" lists
+OPEN_STATUSES = "Scheduled,Confirmed,Cancelled"
+HISTORY_PAGE_SIZE = 20
+
+
+def post_with_retry(url, attempts=3, **kwargs):
+    """POST with one Idempotency-Key across retries, so a retry after a lost
+    response returns the original result instead of repeating the write."""
+    headers = dict(kwargs.pop("headers", None) or {}, **{"Idempotency-Key": uuid.uuid4().hex})
+    for attempt in range(attempts):
+        try:
+            return requests.post(url, headers=headers, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == attempts - 1:
+                raise
+
 def main(page: ft.Page):
     page.title = "Patient App"
     token = {"value": None}
@@ -500,24 +517,6 @@ def main(page: ft.Page):
             user_location["lon"] = 73.8567
             return False
 
-    def calculate_distance(lat1, lon1, lat2, lon2):
-        """Calculate distance between two points using Haversine formula"""
-        from math import radians, cos, sin, asin, sqrt
-        
-        if None in (lat1, lon1, lat2, lon2):
-            return float("inf")
-        
-        # Convert decimal degrees to radians
-        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-        
-        # Haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        km = 6371 * c
-        return km
-
     def load_nearby(search_query=None):
         hospitals_list.controls.clear()
         if search_query:
@@ -543,7 +542,7 @@ def main(page: ft.Page):
                     hospitals_list.controls.append(ft.Text("🔍 Searching for nearby hospitals...", color=ft.colors.BLUE))
                 page.update()
                 
-                # Use sample hospitals for now
+                # Use sample hospitals for now; searches go to the server-side text index
                 sample_hospitals = [
                     {
                         'name': 'City General Hospital',
@@ -568,6 +567,14 @@ def main(page: ft.Page):
                     }
                 ]
                 
+                if search_query:
+                    r = requests.get(
+                        f"{API_BASE}/search",
+                        params={"q": search_query, "lat": lat, "lon": lon},
+                        timeout=10,
+                    )
+                    sample_hospitals = r.json().get("results", []) if r.status_code == 200 else []
+                
                 hospitals_list.controls.clear()
                 hospitals_list.controls.append(ft.Text(f"🏥 Found {len(sample_hospitals)} nearby hospitals:", size=16, weight=ft.FontWeight.BOLD, color=ft.colors.GREEN))
                 hospitals_list.controls.append(ft.Text(f"📍 Based on your location: {lat:.4f}, {lon:.4f}", size=12, color=ft.colors.BLUE))
@@ -669,11 +676,15 @@ def main(page: ft.Page):
         
         try:
             headers = {"Authorization": f"Bearer {token['value']}"}
-            r = requests.get(f"{API_BASE}/appointments/{user_id['value']}?today=true", headers=headers, timeout=10)
+            r = requests.get(
+                f"{API_BASE}/appointments/{user_id['value']}",
+                params={"today": "true", "status": OPEN_STATUSES},
+                headers=headers,
+                timeout=10,
+            )
             
             if r.status_code == 200:
-                appointments = r.json().get("appointments", [])
-                active_appointments = [a for a in appointments if a.get('status') != 'Completed']
+                active_appointments = r.json().get("appointments", [])
                 
                 if active_appointments:
                     for a in active_appointments:
@@ -793,8 +804,12 @@ def main(page: ft.Page):
             )
         page.update()
 
-    def load_completed_appointments():
-        completed_appt_list.controls.clear()
+    def load_completed_appointments(cursor=None):
+        # Newest first, one page at a time; "Load more" fetches the next page
+        if cursor is None:
+            completed_appt_list.controls.clear()
+        elif completed_appt_list.controls:
+            completed_appt_list.controls.pop()  # the "Load more" button
         
         if not token["value"] or not user_id["value"]:
             completed_appt_list.controls.append(
@@ -813,11 +828,14 @@ def main(page: ft.Page):
         
         try:
             headers = {"Authorization": f"Bearer {token['value']}"}
-            r = requests.get(f"{API_BASE}/appointments/{user_id['value']}", headers=headers, timeout=10)
+            params = {"status": "Completed", "order": "desc", "limit": HISTORY_PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            r = requests.get(f"{API_BASE}/appointments/{user_id['value']}", params=params, headers=headers, timeout=10)
             
             if r.status_code == 200:
-                appointments = r.json().get("appointments", [])
-                completed_appts = [a for a in appointments if a.get('status') == 'Completed']
+                completed_appts = r.json().get("appointments", [])
+                next_cursor = r.json().get("next_cursor")
                 
                 if completed_appts:
                     for a in completed_appts:
@@ -852,7 +870,11 @@ def main(page: ft.Page):
                                 margin=ft.margin.symmetric(vertical=6),
                             )
                         )
-                else:
+                    if next_cursor:
+                        completed_appt_list.controls.append(
+                            ft.TextButton("Load more", on_click=lambda e, c=next_cursor: load_completed_appointments(c))
+                        )
+                elif cursor is None:
                     completed_appt_list.controls.append(
                         ft.Container(
                             content=ft.Column([
@@ -946,7 +968,7 @@ def main(page: ft.Page):
                 page.update()
                 return
             
-            r = requests.post(f"{API_BASE}/register", json={
+            r = post_with_retry(f"{API_BASE}/register", json={
                 "email": signup_email.value,
                 "password": signup_password.value,
                 "user_type": "Patient",
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Move completed and cancelled appointments older than ARCHIVE_AFTER_DAYS into
+appointments_archive. Safe to interrupt and re-run; schedule it daily.
+
+    python archive_appointments.py [--older-than-days 90] [--batch-size 1000] [--max-batches N]
+"""
+
+import argparse
+
+from backend import create_app
+from backend.archive import archive_finished
+
+
+def main() -> None:
+    app = create_app()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--older-than-days", type=int, default=app.config["ARCHIVE_AFTER_DAYS"])
+    parser.add_argument("--batch-size", type=int, default=app.config["ARCHIVE_BATCH_SIZE"])
+    parser.add_argument("--max-batches", type=int, default=None)
+    args = parser.parse_args()
+
+    with app.app_context():
+        moved = archive_finished(args.older_than_days, args.batch_size, args.max_batches)
+    print(f"Archived {moved} appointments older than {args.older_than_days} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,14 +14,15 @@ def create_app() -> Flask:
     from .routes.auth import auth_bp
     from .routes.hospitals import hospitals_bp
     from .routes.appointments import appointments_bp
+    from .routes.search import search_bp
+    from .routes.hospital_admin import hospital_admin_bp
 
     app.register_blueprint(auth_bp, url_prefix="/api")
     app.register_blueprint(hospitals_bp, url_prefix="/api")
     app.register_blueprint(appointments_bp, url_prefix="/api")
-    
-    # Register hospital admin routes
-    # from .routes.hospital_admin import hospital_admin_bp
-    # app.register_blueprint(hospital_admin_bp, url_prefix="/api")
+    app.register_blueprint(search_bp, url_prefix="/api")
+    # Doctor management and dashboard stats; every view requires a hospital admin token
+    app.register_blueprint(hospital_admin_bp, url_prefix="/api")
 
     @app.get("/health")
     def health_check():
@@ -0,0 +1,236 @@
+"""Materialized daily agendas for the doctor dashboard.
+
+``doctor_agendas`` holds one pre-encoded JSON document per (doctor, day):
+that day's appointments in time order plus per-status counts. Every
+appointment write marks the days it touches, and those rows are rebuilt just
+before the transaction commits, after locking them, so two concurrent
+bookings for the same day can't overwrite each other's rebuild. Bulk UPDATEs
+bypass the mapper events and call ``touch`` themselves. ``build_agendas.py``
+materializes the coming days ahead of time and drops past ones.
+
+``agendas`` keeps rows in process memory. Payloads rebuilt by local commits
+replace cached entries straight away; rows written by other processes are
+picked up after ``ttl`` seconds. Serving a dashboard is a dict lookup, or one
+primary key read on a miss.
+"""
+
+import threading
+import time as clock
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, event, inspect, select, tuple_, update
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import db, upsert_insert
+from .models import Appointment, AppointmentStatus, Doctor, DoctorAgenda
+from .serialization import dumps, json_list, serialize_appointment
+
+Key = Tuple[int, date]
+
+_COLUMNS = (
+    Appointment.appointment_id, Appointment.patient_id, Appointment.doctor_id, Appointment.hospital_id,
+    Appointment.date, Appointment.time, Appointment.reason, Appointment.status,
+)
+
+
+def encode(doctor_id: int, day: date, version: int, rows) -> bytes:
+    counts = {s.value: 0 for s in AppointmentStatus}
+    for row in rows:
+        counts[row.status.value] += 1
+    return json_list(
+        "appointments", [dumps(serialize_appointment(row)) for row in rows],
+        doctor_id=doctor_id, date=day.isoformat(), counts=counts, total=len(rows), version=version,
+    )
+
+
+def rebuild(session: Session, keys: Iterable[Key]) -> Dict[Key, Tuple[int, bytes]]:
+    """Re-encode the agenda rows for ``keys`` from the appointments; returns key -> (version, payload).
+
+    Runs in the caller's transaction, which must commit for the rows to stick.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    now = datetime.utcnow()
+    session.execute(
+        upsert_insert(session, DoctorAgenda)
+        .values([{"doctor_id": d, "day": day, "payload": b"", "version": 0, "built_at": now} for d, day in keys])
+        .on_conflict_do_nothing()
+    )
+    # Lock in key order so concurrent rebuilds can't deadlock; reading the
+    # appointments after the lock sees every booking committed before it
+    versions = {
+        (d, day): version for d, day, version in session.execute(
+            select(DoctorAgenda.doctor_id, DoctorAgenda.day, DoctorAgenda.version)
+            .where(tuple_(DoctorAgenda.doctor_id, DoctorAgenda.day).in_(keys))
+            .order_by(DoctorAgenda.doctor_id, DoctorAgenda.day)
+            .with_for_update()
+        )
+    }
+    rows: Dict[Key, list] = {key: [] for key in keys}
+    for row in session.execute(
+        select(*_COLUMNS)
+        .where(Appointment.doctor_id.in_({d for d, _ in keys}), Appointment.date.in_({day for _, day in keys}))
+    ):
+        if (row.doctor_id, row.date) in rows:
+            rows[(row.doctor_id, row.date)].append(row)
+    for day_rows in rows.values():
+        day_rows.sort(key=lambda r: (r.time, r.appointment_id))
+
+    built = {key: (versions[key] + 1, encode(*key, versions[key] + 1, rows[key])) for key in keys}
+    session.execute(update(DoctorAgenda), [
+        {"doctor_id": d, "day": day, "payload": payload, "version": version, "built_at": now}
+        for (d, day), (version, payload) in built.items()
+    ])
+    return built
+
+
+def touch(session: Session, keys: Iterable[Key]) -> None:
+    """Mark (doctor_id, day) agendas for rebuild when ``session`` commits."""
+    session.info.setdefault("agenda_days_changed", set()).update(keys)
+
+
+def _mark_appointment_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    # A booking moved to another doctor or day changes both agendas
+    attrs = inspect(target).attrs
+    old_doctor = next(iter(attrs.doctor_id.history.deleted), target.doctor_id)
+    old_day = next(iter(attrs.date.history.deleted), target.date)
+    touch(session, {(target.doctor_id, target.date), (old_doctor, old_day)})
+
+
+for _evt in ("after_insert", "after_update", "after_delete"):
+    event.listen(Appointment, _evt, _mark_appointment_changed)
+
+
+@event.listens_for(Doctor, "after_delete")
+def _mark_doctor_deleted(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("agenda_doctors_deleted", set()).add((target.doctor_id, target.user_id))
+
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_before_commit(session) -> None:
+    if session.in_nested_transaction():
+        return
+    # Flush first so the mapper events above have seen every pending write
+    session.flush()
+    keys = session.info.pop("agenda_days_changed", None)
+    # Deleting a doctor deletes their appointments, which marks their days;
+    # the agenda rows go with the doctor instead (ON DELETE CASCADE, which
+    # SQLite only enforces when foreign keys are switched on)
+    gone = {doctor_id for doctor_id, _ in session.info.get("agenda_doctors_deleted", ())}
+    if gone:
+        session.execute(delete(DoctorAgenda).where(DoctorAgenda.doctor_id.in_(gone)))
+    keys = {key for key in keys or () if key[0] not in gone}
+    if keys:
+        session.info.setdefault("agendas_built", {}).update(rebuild(session, keys))
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_after_commit(session) -> None:
+    for key, (version, payload) in session.info.pop("agendas_built", {}).items():
+        agendas.put(key, version, payload)
+    agendas.forget_users(user_id for _, user_id in session.info.pop("agenda_doctors_deleted", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("agenda_days_changed", None)
+    session.info.pop("agendas_built", None)
+    session.info.pop("agenda_doctors_deleted", None)
+
+
+class AgendaCache:
+    """Process-local LRU of encoded agendas keyed by (doctor_id, day).
+
+    An entry is only replaced by an equal or newer ``version``, so a slow
+    read can't clobber what a local commit just stored.
+    """
+
+    def __init__(self, maxsize: int = 20000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[Key, Tuple[float, int, bytes]]" = OrderedDict()
+        self._doctors: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def doctor_for_user(self, user_id: int) -> Optional[int]:
+        doctor_id = self._doctors.get(user_id)
+        if doctor_id is None:
+            doctor_id = db.session.scalar(select(Doctor.doctor_id).where(Doctor.user_id == user_id))
+            if doctor_id is not None:
+                with self._lock:
+                    self._doctors[user_id] = doctor_id
+        return doctor_id
+
+    def forget_users(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._doctors.pop(user_id, None)
+
+    def put(self, key: Key, version: int, payload: bytes) -> None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > version:
+                return
+            self._items[key] = (clock.monotonic(), version, payload)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get(self, doctor_id: int, day: date) -> bytes:
+        key = (doctor_id, day)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and clock.monotonic() - item[0] <= self.ttl:
+                self._items.move_to_end(key)
+                return item[2]
+        row = db.session.execute(
+            select(DoctorAgenda.version, DoctorAgenda.payload)
+            .where(DoctorAgenda.doctor_id == doctor_id, DoctorAgenda.day == day)
+        ).first()
+        if row is None:
+            # Not materialized yet
+            version, payload = rebuild(db.session, [key])[key]
+            db.session.commit()
+        else:
+            version, payload = row
+        self.put(key, version, payload)
+        return payload
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._doctors.clear()
+
+
+agendas = AgendaCache()
+
+
+def build_days(start: date, days: int, batch_size: int = 500) -> int:
+    """Materialize every doctor's agenda for ``days`` days from ``start``; return rows built.
+
+    Each batch of doctors is its own transaction.
+    """
+    doctor_ids = list(db.session.scalars(select(Doctor.doctor_id).order_by(Doctor.doctor_id)))
+    total = 0
+    for i in range(0, len(doctor_ids), batch_size):
+        batch = doctor_ids[i:i + batch_size]
+        total += len(rebuild(db.session, [
+            (doctor_id, start + timedelta(days=offset)) for doctor_id in batch for offset in range(days)
+        ]))
+        db.session.commit()
+    return total
+
+
+def purge_before(day: date) -> int:
+    """Drop materialized agendas for days before ``day``; return how many."""
+    deleted = db.session.execute(delete(DoctorAgenda).where(DoctorAgenda.day < day)).rowcount
+    db.session.commit()
+    return deleted
@@ -0,0 +1,64 @@
+"""Move finished appointments out of the hot ``appointments`` table.
+
+Completed and cancelled appointments older than a cutoff are copied to
+``appointments_archive`` and deleted from ``appointments`` in batches. Each
+batch is its own transaction, so an interrupted run loses nothing and the
+next run carries on where it stopped. History endpoints read both tables.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, literal, select
+
+from .extensions import db
+from .models import Appointment, AppointmentChange, AppointmentStatus, ArchivedAppointment
+
+FINISHED = (AppointmentStatus.COMPLETED, AppointmentStatus.CANCELLED)
+
+_COLUMNS = [
+    "appointment_id", "patient_id", "doctor_id", "hospital_id", "date", "time",
+    "reason", "status", "created_at", "row_version",
+]
+
+
+def _next_batch(cutoff: date, batch_size: int) -> List[int]:
+    return list(db.session.scalars(
+        select(Appointment.appointment_id)
+        .where(Appointment.date < cutoff, Appointment.status.in_(FINISHED))
+        .order_by(Appointment.appointment_id)
+        .limit(batch_size)
+    ))
+
+
+def archive_batch(cutoff: date, batch_size: int) -> int:
+    """Archive up to ``batch_size`` finished appointments dated before ``cutoff``; return how many."""
+    ids = _next_batch(cutoff, batch_size)
+    if not ids:
+        db.session.rollback()
+        return 0
+    db.session.execute(insert(ArchivedAppointment).from_select(
+        [*_COLUMNS, "archived_at"],
+        select(
+            *(getattr(Appointment, c) for c in _COLUMNS),
+            literal(datetime.utcnow(), ArchivedAppointment.archived_at.type),
+        ).where(Appointment.appointment_id.in_(ids)),
+    ))
+    # Feed entries point at the hot rows; anything this old has long been consumed
+    db.session.execute(delete(AppointmentChange).where(AppointmentChange.appointment_id.in_(ids)))
+    db.session.execute(delete(Appointment).where(Appointment.appointment_id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+
+def archive_finished(older_than_days: int, batch_size: int, max_batches: Optional[int] = None) -> int:
+    """Archive in batches until nothing is left (or ``max_batches`` ran); return the total moved."""
+    cutoff = date.today() - timedelta(days=older_than_days)
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+    return total
@@ -0,0 +1,212 @@
+"""Process-local, versioned snapshot of the hospital catalog.
+
+Hospital rows change rarely, so read endpoints are served from an immutable
+snapshot instead of the database. Any commit that inserts, updates or deletes
+a hospital bumps ``catalog_version()``; the next read rebuilds the snapshot.
+Doctor rows get a per-hospital version, ``doctor_version(hospital_id)``, used
+to validate cached doctor listings.
+Versions are per process. Writes made by another process (a second worker,
+``init_db.py``, a cron job, manual SQL) are picked up because every version
+is also bumped once ``CATALOG_TTL_SECONDS`` have passed since the last
+refresh.
+"""
+
+import threading
+import time as clock
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import db
+from .geo import GridIndex, coordinate_arrays
+from .models import Doctor, Hospital
+from .serialization import dumps, json_list
+
+
+class HospitalRecord(NamedTuple):
+    hospital_id: int
+    name: str
+    address: str
+    latitude: Optional[float]
+    longitude: Optional[float]
+    fee_details: Optional[str]
+    phone: Optional[str]
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class CatalogSnapshot:
+    """Immutable view of every hospital at one catalog version.
+
+    Records are ordered by hospital_id; array positions follow that order.
+    """
+
+    def __init__(self, version: int, records: Tuple[HospitalRecord, ...], cell_ids: Tuple[Optional[int], ...]):
+        self.version = version
+        self.built_at = datetime.now(timezone.utc)
+        self.records = records
+        self.by_id: Dict[int, HospitalRecord] = {r.hospital_id: r for r in records}
+        self.ids = np.array([r.hospital_id for r in records], dtype=np.int64)
+        self.lats, self.lons, self.mask = coordinate_arrays(
+            [r.latitude for r in records], [r.longitude for r in records]
+        )
+        # Positions of located records ordered by cell id, so a cell range is a
+        # binary search instead of a scan
+        located = [i for i, c in enumerate(cell_ids) if c is not None]
+        located.sort(key=lambda i: cell_ids[i])
+        self.cell_order = np.array(located, dtype=np.intp)
+        self.sorted_cells = np.array([cell_ids[i] for i in located], dtype=np.int64)
+        self.grid = GridIndex.build((r.hospital_id, r.latitude, r.longitude) for r in records)
+        # Encoded once per version; responses are stitched from these bytes
+        self.fragments: Tuple[bytes, ...] = tuple(dumps(r.to_dict()) for r in records)
+        self.fragment_by_id: Dict[int, bytes] = {
+            r.hospital_id: f for r, f in zip(records, self.fragments)
+        }
+        self.list_payload = json_list("hospitals", self.fragments)
+
+    def in_cells(self, ranges) -> np.ndarray:
+        """Return record positions whose cell id falls in any inclusive range."""
+        parts = []
+        for lo, hi in ranges:
+            start = np.searchsorted(self.sorted_cells, lo, side="left")
+            stop = np.searchsorted(self.sorted_cells, hi, side="right")
+            parts.append(self.cell_order[start:stop])
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(parts))
+
+
+_lock = threading.Lock()
+_started_at = datetime.now(timezone.utc)
+_version = 0
+_changed_at = _started_at
+_snapshot: Optional[CatalogSnapshot] = None
+_doctor_versions: Dict[int, Tuple[int, datetime]] = {}
+_all_doctors_version: Tuple[int, datetime] = (0, _started_at)
+# Version and change time of hospitals whose doctors changed in no local
+# commit since the last expiry; above every per-hospital version issued
+_doctor_floor: Tuple[int, datetime] = (0, _started_at)
+
+# Upper bound on how long writes from other processes stay invisible
+CATALOG_TTL_SECONDS = 300.0
+_refreshed = clock.monotonic()
+
+
+def _expire_if_stale() -> None:
+    """Bump every version once the TTL has run out, so the next read reloads from the database."""
+    global _version, _changed_at, _all_doctors_version, _doctor_floor, _refreshed
+    if clock.monotonic() - _refreshed <= CATALOG_TTL_SECONDS:
+        return
+    with _lock:
+        if clock.monotonic() - _refreshed <= CATALOG_TTL_SECONDS:
+            return
+        now = datetime.now(timezone.utc)
+        _version += 1
+        _changed_at = now
+        _all_doctors_version = (_all_doctors_version[0] + 1, now)
+        highest = max((v for v, _ in _doctor_versions.values()), default=_doctor_floor[0])
+        _doctor_floor = (max(highest, _doctor_floor[0]) + 1, now)
+        _doctor_versions.clear()
+        _refreshed = clock.monotonic()
+
+
+def catalog_version() -> int:
+    _expire_if_stale()
+    return _version
+
+
+def catalog_changed_at() -> datetime:
+    _expire_if_stale()
+    return _changed_at
+
+
+def bump_catalog_version() -> int:
+    global _version, _changed_at
+    with _lock:
+        _version += 1
+        _changed_at = datetime.now(timezone.utc)
+        return _version
+
+
+def doctor_version(hospital_id: int) -> Tuple[int, datetime]:
+    """Return (version, changed_at) of the doctors listed under a hospital."""
+    _expire_if_stale()
+    return _doctor_versions.get(hospital_id, _doctor_floor)
+
+
+def all_doctors_version() -> Tuple[int, datetime]:
+    """(version, changed_at) covering every hospital's doctors, for responses spanning hospitals."""
+    _expire_if_stale()
+    return _all_doctors_version
+
+
+def bump_doctor_versions(hospital_ids) -> None:
+    global _all_doctors_version
+    now = datetime.now(timezone.utc)
+    with _lock:
+        _all_doctors_version = (_all_doctors_version[0] + 1, now)
+        for hospital_id in hospital_ids:
+            version, _ = _doctor_versions.get(hospital_id, _doctor_floor)
+            _doctor_versions[hospital_id] = (version + 1, now)
+
+
+def get_snapshot() -> CatalogSnapshot:
+    global _snapshot
+    _expire_if_stale()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == _version:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.version != _version:
+            version = _version
+            rows = db.session.query(
+                Hospital.hospital_id, Hospital.name, Hospital.address, Hospital.latitude,
+                Hospital.longitude, Hospital.fee_details, Hospital.phone, Hospital.cell_id,
+            ).order_by(Hospital.hospital_id).all()
+            _snapshot = CatalogSnapshot(
+                version,
+                tuple(HospitalRecord(*row[:-1]) for row in rows),
+                tuple(row[-1] for row in rows),
+            )
+        return _snapshot
+
+
+def _mark_hospitals_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info["hospitals_changed"] = True
+
+
+def _mark_doctors_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    # A doctor moved between hospitals invalidates both listings
+    hospital_ids = {target.hospital_id, *inspect(target).attrs.hospital_id.history.deleted}
+    session.info.setdefault("doctor_hospitals_changed", set()).update(
+        h for h in hospital_ids if h is not None
+    )
+
+
+for _evt in ("after_insert", "after_update", "after_delete"):
+    event.listen(Hospital, _evt, _mark_hospitals_changed)
+    event.listen(Doctor, _evt, _mark_doctors_changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session) -> None:
+    if session.info.pop("hospitals_changed", False):
+        bump_catalog_version()
+    changed = session.info.pop("doctor_hospitals_changed", None)
+    if changed:
+        bump_doctor_versions(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("hospitals_changed", None)
+    session.info.pop("doctor_hospitals_changed", None)
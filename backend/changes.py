@@ -0,0 +1,170 @@
+"""Appointment change feed.
+
+Every appointment insert or update appends a row to ``appointment_changes``
+in the same transaction; its ``seq`` is the feed position clients resume
+from. ORM writes are recorded by mapper events, bulk UPDATEs call
+``record_changes`` themselves.
+
+Long-poll requests wait on a process-local condition that is notified after
+each commit touching appointments, and re-query every ``POLL_INTERVAL``
+seconds to pick up writes made by other processes.
+"""
+
+import threading
+import time as clock
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, insert, literal, select
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import db
+from .models import Appointment, AppointmentChange
+
+MAX_WAIT_SECONDS = 60
+POLL_INTERVAL = 2.0
+MAX_CHANGES = 500
+
+# seq is assigned at insert, so on a database with concurrent writers a
+# transaction can commit after a later seq is already visible. Rows younger
+# than this are held back so a client cursor does not skip past them.
+SETTLE_SECONDS = 1.0
+
+_changed = threading.Condition()
+_commits = 0
+
+
+def record_changes(appointment_ids: Iterable[int]) -> None:
+    """Log changes for appointments written with a bulk UPDATE; call before commit."""
+    ids = list(appointment_ids)
+    if not ids:
+        return
+    db.session.execute(insert(AppointmentChange).from_select(
+        ["appointment_id", "doctor_id", "patient_id", "changed_at"],
+        select(
+            Appointment.appointment_id, Appointment.doctor_id, Appointment.patient_id,
+            literal(datetime.utcnow(), AppointmentChange.changed_at.type),
+        ).where(Appointment.appointment_id.in_(ids)),
+    ))
+    db.session.info["appointments_changed"] = True
+
+
+def _record_orm_change(connection, target, kind: str) -> None:
+    connection.execute(insert(AppointmentChange).values(
+        appointment_id=target.appointment_id,
+        doctor_id=target.doctor_id,
+        patient_id=target.patient_id,
+        kind=kind,
+        changed_at=datetime.utcnow(),
+    ))
+    session = object_session(target)
+    if session is not None:
+        session.info["appointments_changed"] = True
+
+
+@event.listens_for(Appointment, "after_insert")
+def _record_insert(mapper, connection, target) -> None:
+    _record_orm_change(connection, target, "created")
+
+
+@event.listens_for(Appointment, "after_update")
+def _record_update(mapper, connection, target) -> None:
+    _record_orm_change(connection, target, "updated")
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session) -> None:
+    global _commits
+    if session.info.pop("appointments_changed", False):
+        with _changed:
+            _commits += 1
+            _changed.notify_all()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("appointments_changed", None)
+
+
+def commit_count() -> int:
+    """Local commits that touched appointments; pass to ``wait_for_commit``."""
+    return _commits
+
+
+def wait_for_commit(seen: int, timeout: float) -> None:
+    """Block until a local appointment commit after ``seen`` or the timeout."""
+    with _changed:
+        _changed.wait_for(lambda: _commits != seen, timeout)
+
+
+def head() -> int:
+    return db.session.query(db.func.max(AppointmentChange.seq)).scalar() or 0
+
+
+def days_changed_since(since: int) -> Tuple[Set[Tuple[int, date]], int]:
+    """(doctor_id, date) of appointments changed after ``since``, and the seq to resume from.
+
+    The resume position stays below changes younger than ``SETTLE_SECONDS``,
+    so they are read again next time in case an earlier seq commits late.
+    """
+    rows = db.session.query(
+        AppointmentChange.seq, AppointmentChange.changed_at, Appointment.doctor_id, Appointment.date
+    ).join(
+        Appointment, Appointment.appointment_id == AppointmentChange.appointment_id
+    ).filter(AppointmentChange.seq > since).all()
+    resume = max((row.seq for row in rows), default=since)
+    if db.engine.dialect.name != "sqlite":  # SQLite serializes writers
+        cutoff = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+        resume = min([resume] + [row.seq - 1 for row in rows if row.changed_at > cutoff])
+    return {(row.doctor_id, row.date) for row in rows}, resume
+
+
+class Change(NamedTuple):
+    seq: int
+    appointment: Appointment
+    # The appointment was inserted within the window that was read
+    created: bool
+
+
+def changes_since(since: int, doctor_id: Optional[int] = None, patient_id: Optional[int] = None,
+                  hospital_id: Optional[int] = None, limit: int = MAX_CHANGES) -> Tuple[List[Change], bool]:
+    """Return ([Change], more) for changes after ``since``, oldest first.
+
+    Optionally scoped to one doctor, patient or hospital. An appointment
+    changed several times is reported once, at its latest seq and state.
+    """
+    q = db.session.query(AppointmentChange.seq, AppointmentChange.kind, Appointment).join(
+        Appointment, Appointment.appointment_id == AppointmentChange.appointment_id
+    ).filter(AppointmentChange.seq > since)
+    if doctor_id is not None:
+        q = q.filter(AppointmentChange.doctor_id == doctor_id)
+    if patient_id is not None:
+        q = q.filter(AppointmentChange.patient_id == patient_id)
+    if hospital_id is not None:
+        q = q.filter(Appointment.hospital_id == hospital_id)
+    if db.engine.dialect.name != "sqlite":  # SQLite serializes writers
+        q = q.filter(AppointmentChange.changed_at <= datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS))
+    rows = q.order_by(AppointmentChange.seq).limit(limit + 1).all()
+    more = len(rows) > limit
+    latest = {}
+    for seq, kind, appt in rows[:limit]:
+        created = kind == "created" or (appt.appointment_id in latest and latest[appt.appointment_id].created)
+        latest[appt.appointment_id] = Change(seq, appt, created)
+    # Detached rows stay loaded when poll() ends the transaction
+    for change in latest.values():
+        db.session.expunge(change.appointment)
+    return sorted(latest.values(), key=lambda c: c.seq), more
+
+
+def poll(since: int, wait: float, **scope) -> Tuple[List[Change], bool]:
+    """``changes_since``, blocking up to ``wait`` seconds while there are none."""
+    deadline = clock.monotonic() + wait
+    while True:
+        seen = commit_count()
+        changes, more = changes_since(since, **scope)
+        # Don't hold a connection or snapshot while waiting
+        db.session.rollback()
+        remaining = deadline - clock.monotonic()
+        if changes or remaining <= 0:
+            return changes, more
+        wait_for_commit(seen, min(remaining, POLL_INTERVAL))
@@ -12,3 +12,10 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "dev-secret-change-me")
     PROPAGATE_EXCEPTIONS = True
+    # Completed/cancelled appointments older than this move to appointments_archive
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+    # Days of doctor agendas, starting today, that build_agendas.py materializes ahead of time
+    AGENDA_DAYS_AHEAD = int(os.getenv("AGENDA_DAYS_AHEAD", "2"))
+    # Past days reconcile_stats.py re-checks the dashboard counters for, besides upcoming ones
+    STATS_RECONCILE_DAYS = int(os.getenv("STATS_RECONCILE_DAYS", "7"))
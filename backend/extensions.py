@@ -1,8 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 
 db = SQLAlchemy()
 jwt = JWTManager()
 cors = CORS()
+
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+def upsert_insert(session, model):
+    """``insert(model)`` for the session's dialect, with ``on_conflict_do_nothing``/``_do_update``."""
+    return _UPSERT_INSERTS[session.get_bind().dialect.name](model)
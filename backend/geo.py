@@ -0,0 +1,288 @@
+import heapq
+from math import radians, degrees, cos, sin, asin, sqrt, ceil, floor, pi, isfinite
+from typing import Container, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = EARTH_RADIUS_KM * pi / 180
+
+# Hierarchical cell ids interleave CELL_BITS of longitude and latitude the same
+# way a geohash does (longitude bit first), but are stored as integers so a
+# cell at any depth is one contiguous range on a plain B-tree index.
+CELL_BITS = 26
+
+
+def valid_coordinates(lat: float, lon: float) -> bool:
+    """True for a finite latitude in [-90, 90] and longitude in [-180, 180]."""
+    return isfinite(lat) and isfinite(lon) and -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    if None in (lat1, lon1, lat2, lon2):
+        return float("inf")
+    # convert decimal degrees to radians
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    # haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    km = EARTH_RADIUS_KM * c
+    return km
+
+
+def coordinate_arrays(lats: Sequence[Optional[float]], lons: Sequence[Optional[float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pack possibly-missing coordinates into contiguous float64 arrays.
+
+    Returns (lats, lons, mask) where mask is True for rows that have both a
+    latitude and a longitude. Missing values are stored as NaN.
+    """
+    lat_arr = np.fromiter((np.nan if v is None else v for v in lats), dtype=np.float64, count=len(lats))
+    lon_arr = np.fromiter((np.nan if v is None else v for v in lons), dtype=np.float64, count=len(lons))
+    mask = ~(np.isnan(lat_arr) | np.isnan(lon_arr))
+    return lat_arr, lon_arr, mask
+
+
+def haversine_many(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Vectorized haversine from one origin to every point, in km.
+
+    Rows with missing coordinates come out as NaN; callers select valid rows
+    with the mask from coordinate_arrays rather than comparing sentinels.
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def nearest_k(distances: np.ndarray, mask: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """Return indices of the k smallest distances among masked-in rows, nearest first.
+
+    Uses a partial partition so only the selected k rows are sorted; ``k=None``
+    ranks every valid row. Ties keep their original order, including at the
+    k-th boundary, so results are stable enough for keyset pagination.
+    """
+    valid = np.flatnonzero(mask)
+    d = distances[valid]
+    if k is not None and k < len(valid):
+        if k <= 0:
+            return valid[:0]
+        kth = np.partition(d, k - 1)[k - 1]
+        below = np.flatnonzero(d < kth)
+        ties = np.flatnonzero(d == kth)[:k - len(below)]
+        picked = np.concatenate([below, ties])
+        picked.sort()
+    else:
+        picked = np.arange(len(valid))
+    order = picked[np.argsort(d[picked], kind="stable")]
+    return valid[order]
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km.
+
+    Longitude bounds widen to the full range when the circle reaches a pole.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if max_lat >= 90 or min_lat <= -90 or angular >= 1:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = degrees(asin(min(1.0, sin(angular) / cos(radians(lat)))))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def _interleave(lon_idx: int, lat_idx: int, bits: int) -> int:
+    code = 0
+    for i in range(bits - 1, -1, -1):
+        code = (code << 2) | (((lon_idx >> i) & 1) << 1) | ((lat_idx >> i) & 1)
+    return code
+
+
+def _cell_indices(lat: float, lon: float) -> Tuple[int, int]:
+    top = (1 << CELL_BITS) - 1
+    lat_idx = min(top, max(0, int((lat + 90.0) / 180.0 * (1 << CELL_BITS))))
+    lon_idx = min(top, max(0, int((lon + 180.0) / 360.0 * (1 << CELL_BITS))))
+    return lat_idx, lon_idx
+
+
+def cell_id(lat: Optional[float], lon: Optional[float]) -> Optional[int]:
+    """Return the full-depth hierarchical cell id for a coordinate."""
+    if lat is None or lon is None:
+        return None
+    lat_idx, lon_idx = _cell_indices(lat, lon)
+    return _interleave(lon_idx, lat_idx, CELL_BITS)
+
+
+def _cell_depth(min_lat: float, max_lat: float, radius_km: float) -> int:
+    # Deepest level whose cells are at least radius_km on each side, so the
+    # 3x3 block around the origin cell covers the whole search circle.
+    widest_lat = radians(max(abs(min_lat), abs(max_lat)))
+    depth = 0
+    while depth < CELL_BITS:
+        cells = 1 << (depth + 1)
+        height_km = 180.0 / cells * KM_PER_DEGREE
+        width_km = 360.0 / cells * KM_PER_DEGREE * cos(widest_lat)
+        if height_km < radius_km or width_km < radius_km:
+            break
+        depth += 1
+    return depth
+
+
+def cell_ranges(lat: float, lon: float, radius_km: float) -> List[Tuple[int, int]]:
+    """Return inclusive cell id ranges covering a circle of radius_km.
+
+    At most nine ranges are produced (fewer once adjacent ones are merged);
+    each maps to one indexed range scan.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    if max_lon - min_lon >= 360.0:
+        return [(0, (1 << (2 * CELL_BITS)) - 1)]
+    depth = _cell_depth(min_lat, max_lat, radius_km)
+    shift = CELL_BITS - depth
+    lat_idx, lon_idx = _cell_indices(lat, lon)
+    lat_idx >>= shift
+    lon_idx >>= shift
+    span = 1 << depth
+    prefixes = set()
+    for dlat in (-1, 0, 1):
+        row = lat_idx + dlat
+        if not 0 <= row < span:
+            continue
+        for dlon in (-1, 0, 1):
+            prefixes.add(_interleave((lon_idx + dlon) % span, row, depth))
+    ranges: List[Tuple[int, int]] = []
+    for prefix in sorted(prefixes):
+        lo = prefix << (2 * shift)
+        hi = ((prefix + 1) << (2 * shift)) - 1
+        if ranges and ranges[-1][1] + 1 == lo:
+            ranges[-1] = (ranges[-1][0], hi)
+        else:
+            ranges.append((lo, hi))
+    return ranges
+
+
+class GridIndex:
+    """Uniform lat/lon bucket grid for k-nearest and radius lookups.
+
+    Points are hashed into square cells of ``cell_deg`` degrees. Columns wrap
+    around the antimeridian and rows stop at the poles. Queries walk the cells
+    around the origin ring by ring and stop as soon as the k-th best distance
+    is covered, so only candidate cells are scanned.
+    """
+
+    def __init__(self, cell_deg: float = 0.1):
+        self.cell_deg = cell_deg
+        self._cols = max(1, round(360.0 / cell_deg))
+        self._rows = max(1, ceil(180.0 / cell_deg))
+        self._cells: Dict[Tuple[int, int], List[Tuple[Hashable, float, float]]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        """(row, column) of a coordinate; the column is not wrapped, so box edges compare in order."""
+        row = min(self._rows - 1, max(0, floor((lat + 90.0) / self.cell_deg)))
+        return row, floor((lon + 180.0) / self.cell_deg)
+
+    def _ring_distance(self, cell: Tuple[int, int], row: int, col: int) -> int:
+        dc = (cell[1] - col) % self._cols
+        return max(abs(cell[0] - row), min(dc, self._cols - dc))
+
+    def insert(self, key: Hashable, lat: float, lon: float) -> None:
+        row, col = self._cell(lat, lon)
+        self._cells.setdefault((row, col % self._cols), []).append((key, lat, lon))
+        self._size += 1
+
+    @classmethod
+    def build(cls, points: Iterable[Tuple[Hashable, float, float]], cell_deg: float = 0.1) -> "GridIndex":
+        index = cls(cell_deg)
+        for key, lat, lon in points:
+            if lat is None or lon is None:
+                continue
+            index.insert(key, lat, lon)
+        return index
+
+    def _ring(self, row: int, col: int, r: int) -> Iterable[Tuple[int, int]]:
+        if r == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(rr, c) for c in range(col - r, col + r + 1) for rr in (row - r, row + r)]
+            cells += [(rr, c) for rr in range(row - r + 1, row + r) for c in (col - r, col + r)]
+        for rr, c in cells:
+            if 0 <= rr < self._rows:
+                yield rr, c % self._cols
+
+    def _scan(self, cells: Iterable[Tuple[int, int]], lat: float, lon: float, out: List[Tuple[float, Hashable]],
+              after: Optional[Tuple[float, Hashable]] = None, only: Optional[Container] = None) -> None:
+        for cell in cells:
+            for key, plat, plon in self._cells.get(cell, ()):
+                if only is not None and key not in only:
+                    continue
+                item = (haversine(lat, lon, plat, plon), key)
+                if after is None or item > after:
+                    out.append(item)
+
+    def within(self, lat: float, lon: float, radius_km: float, k: Optional[int] = None,
+               after: Optional[Tuple[float, Hashable]] = None,
+               only: Optional[Container] = None) -> List[Tuple[float, Hashable]]:
+        """Return (distance_km, key) pairs within radius_km, nearest first.
+
+        ``after`` resumes a paginated walk strictly past a previous (distance, key);
+        ``only`` restricts results to the given keys.
+        """
+        if not self._size:
+            return []
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        r0, c0 = self._cell(min_lat, min_lon)
+        r1, c1 = self._cell(max_lat, max_lon)
+        c1 = min(c1, c0 + self._cols - 1)
+        found: List[Tuple[float, Hashable]] = []
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+            cols = {c % self._cols for c in range(c0, c1 + 1)}
+            cells: Iterable[Tuple[int, int]] = (
+                c for c in self._cells if r0 <= c[0] <= r1 and c[1] in cols
+            )
+        else:
+            cells = ((r, c % self._cols) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+        self._scan(cells, lat, lon, found, after, only)
+        found = [item for item in found if item[0] <= radius_km]
+        if k is not None:
+            return heapq.nsmallest(k, found)
+        found.sort()
+        return found
+
+    def nearest(self, lat: float, lon: float, k: int, radius_km: Optional[float] = None,
+                after: Optional[Tuple[float, Hashable]] = None,
+                only: Optional[Container] = None) -> List[Tuple[float, Hashable]]:
+        """Return up to k (distance_km, key) pairs, nearest first."""
+        if radius_km is not None:
+            return self.within(lat, lon, radius_km, k, after, only)
+        if not self._size or k <= 0:
+            return []
+        row, col = self._cell(lat, lon)
+        found: List[Tuple[float, Hashable]] = []
+        r = 0
+        while True:
+            if (2 * r + 1) ** 2 > len(self._cells):
+                # The next ring has more cells than are occupied; scan the rest directly
+                rest = (c for c in self._cells if self._ring_distance(c, row, col) >= r)
+                self._scan(rest, lat, lon, found, after, only)
+                break
+            self._scan(self._ring(row, col, r), lat, lon, found, after, only)
+            if len(found) >= k:
+                # Stop once the k-th best circle fits inside the scanned square.
+                kth = heapq.nsmallest(k, found)[-1][0]
+                min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, kth)
+                lo_r, lo_c = self._cell(min_lat, min_lon)
+                hi_r, hi_c = self._cell(max_lat, max_lon)
+                rows_covered = lo_r >= row - r and hi_r <= row + r
+                cols_covered = 2 * r + 1 >= self._cols or (lo_c >= col - r and hi_c <= col + r)
+                if rows_covered and cols_covered:
+                    break
+            r += 1
+        return heapq.nsmallest(k, found)
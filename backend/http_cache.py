@@ -0,0 +1,60 @@
+"""Conditional GET support for read endpoints.
+
+Views decorated with ``conditional`` declare how to compute their validators
+(a strong ETag and optionally a Last-Modified time) from cheap version
+counters. A matching ``If-None-Match`` / ``If-Modified-Since`` short-circuits
+to 304 before the view runs, so neither the database nor the serializer is
+touched for unchanged resources.
+"""
+
+import uuid
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Optional, Tuple
+
+from flask import Response, make_response, request
+
+# Distinguishes validators issued by this process from those of a previous
+# run, whose in-memory version counters started from the same numbers.
+PROCESS_EPOCH = uuid.uuid4().hex[:12]
+
+Validators = Tuple[str, Optional[datetime]]
+
+
+def make_etag(*parts) -> str:
+    return "-".join([PROCESS_EPOCH, *map(str, parts)])
+
+
+def _is_fresh(etag: str, last_modified: Optional[datetime]) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _with_validators(response: Response, etag: str, last_modified: Optional[datetime]) -> Response:
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(validators: Callable[..., Validators]):
+    """Answer 304 when the client's cached copy matches ``validators(**view_args)``."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validators(*args, **kwargs)
+            if _is_fresh(etag, last_modified):
+                return _with_validators(Response(status=304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return _with_validators(response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
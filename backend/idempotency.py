@@ -0,0 +1,158 @@
+"""Idempotency keys for write endpoints.
+
+A client that may retry a POST sends the same ``Idempotency-Key`` header on
+every attempt. The first attempt claims the key and stores its response;
+retries with the same key and body get that stored response back without the
+view running again, so a lost response can't double-book a slot or pay for
+another password hash. Reusing a key with a different body is rejected.
+
+Keys are scoped to the endpoint and the signed-in caller. Anonymous callers
+are scoped to the exact request, so only a retry with the same body, which
+for registration includes the password, gets a stored response back. Bodies
+are only kept as HMACs keyed with the app secret, never in the clear.
+
+Responses with status 5xx are not stored, so those retries run for real.
+Records expire after ``ttl``; expired rows are purged from time to time
+by whichever request comes next.
+"""
+
+import hashlib
+import hmac
+import json
+import time as clock
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .models import IdempotencyRecord
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = timedelta(hours=24)
+# A claim older than this whose request never finished (crashed worker) may
+# be taken over by a retry
+STALE_CLAIM = timedelta(minutes=2)
+PURGE_INTERVAL_SECONDS = 600
+
+_last_purge = 0.0
+
+
+def _request_hash() -> str:
+    body = request.get_json(silent=True)
+    payload = json.dumps(body, sort_keys=True) if body is not None else request.get_data(as_text=True)
+    raw = "\n".join((request.method, request.path, request.query_string.decode(), payload))
+    # Keyed, so stored hashes of bodies with credentials can't be brute-forced
+    secret = current_app.config["JWT_SECRET_KEY"].encode()
+    return hmac.new(secret, raw.encode(), hashlib.sha256).hexdigest()
+
+
+def _scope(request_hash: str) -> str:
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:  # view is not behind jwt_required
+        identity = None
+    user_id = identity.get("user_id") if isinstance(identity, dict) else identity
+    if not user_id:
+        # Anonymous clients would otherwise share one key space
+        return f"{request.endpoint}:request:{request_hash}"
+    return f"{request.endpoint}:{user_id}"
+
+
+def _purge_expired(now: datetime) -> None:
+    global _last_purge
+    if clock.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = clock.monotonic()
+    IdempotencyRecord.query.filter(IdempotencyRecord.expires_at < now).delete(synchronize_session=False)
+
+
+def _claim(scope: str, key: str, request_hash: str, ttl: timedelta):
+    """Claim the key for this request. Returns None when claimed, else the existing record."""
+    now = datetime.utcnow()
+    _purge_expired(now)
+    record = db.session.get(IdempotencyRecord, (scope, key))
+    if record is not None:
+        stale = record.status_code is None and record.created_at < now - STALE_CLAIM
+        if record.expires_at >= now and not stale:
+            return record
+        db.session.delete(record)
+        db.session.flush()
+    db.session.add(IdempotencyRecord(
+        scope=scope, key=key, request_hash=request_hash, created_at=now, expires_at=now + ttl,
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent attempt with the same key claimed it first
+        db.session.rollback()
+        return db.session.get(IdempotencyRecord, (scope, key))
+    return None
+
+
+def _replay(record: IdempotencyRecord, request_hash: str) -> Response:
+    if record.request_hash != request_hash:
+        return make_response(({"message": f"{HEADER} was already used for a different request"}, 422))
+    if record.status_code is None:
+        return make_response(({"message": f"A request with this {HEADER} is still in progress"}, 409))
+    response = Response(record.body, status=record.status_code, content_type=record.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _finish(scope: str, key: str, response: Response) -> None:
+    db.session.rollback()  # discard anything the view left pending
+    record = db.session.get(IdempotencyRecord, (scope, key))
+    if record is None:
+        return
+    if response.status_code >= 500:
+        db.session.delete(record)
+    else:
+        record.status_code = response.status_code
+        record.content_type = response.content_type
+        record.body = response.get_data()
+    db.session.commit()
+
+
+def _release(scope: str, key: str) -> None:
+    db.session.rollback()
+    IdempotencyRecord.query.filter_by(scope=scope, key=key, status_code=None).delete()
+    db.session.commit()
+
+
+def idempotent(ttl: timedelta = DEFAULT_TTL):
+    """Honour an ``Idempotency-Key`` header on the decorated write view.
+
+    Goes below ``jwt_required`` so keys are scoped to the caller. Requests
+    without the header are passed straight through. Keep ``ttl`` short on
+    views whose responses carry credentials; they are stored until expiry.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return {"message": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}, 400
+
+            request_hash = _request_hash()
+            scope = _scope(request_hash)
+            existing = _claim(scope, key, request_hash, ttl)
+            if existing is not None:
+                return _replay(existing, request_hash)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                _release(scope, key)
+                raise
+            _finish(scope, key, response)
+            return response
+
+        return wrapper
+
+    return decorator
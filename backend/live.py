@@ -0,0 +1,123 @@
+"""In-process fan-out of appointment events to Server-Sent Events streams.
+
+One pump thread per process follows the appointment change feed and
+publishes each change, encoded once, to the subscribers of its doctor and
+hospital topics. Following the feed rather than hooking the request
+handlers means writes made by other processes are pushed too; local commits
+wake the pump immediately.
+
+Each subscriber has a bounded queue. A subscriber whose queue is full when
+an event arrives is evicted: its stream ends after draining what it already
+has, and the client reconnects with ``Last-Event-ID`` to replay what it
+missed from the feed. New subscribers replay from ``Subscription.position``
+for the same reason: the pump may already be past changes committed just
+before they subscribed.
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+
+from flask import Flask
+
+from . import changes
+from .extensions import db
+
+QUEUE_SIZE = 256
+
+Event = Tuple[int, bytes]
+
+
+class Subscription:
+    def __init__(self, topic: Hashable, maxsize: int, position: int):
+        self.topic = topic
+        self.queue: "queue.Queue[Event]" = queue.Queue(maxsize)
+        self.evicted = False
+        # Feed head when subscribing; later changes may reach the queue or
+        # not, depending on where the pump was, so replay from here
+        self.position = position
+
+    def next(self, timeout: float) -> Optional[Event]:
+        """The next (seq, frame); None on timeout. Raises EOFError once evicted and drained."""
+        try:
+            return self.queue.get(timeout=0 if self.evicted else timeout)
+        except queue.Empty:
+            if self.evicted:
+                raise EOFError
+            return None
+
+
+class Broadcaster:
+    """Topic-based pub/sub fed by the appointment change feed.
+
+    ``encode(change)`` turns a ``changes.Change`` into the bytes sent to
+    every subscriber; ``topics(change)`` lists the topics it goes to.
+    """
+
+    def __init__(self, encode: Callable[[changes.Change], bytes],
+                 topics: Callable[[changes.Change], Tuple[Hashable, ...]], queue_size: int = QUEUE_SIZE):
+        self.encode = encode
+        self.topics = topics
+        self.queue_size = queue_size
+        self._subscribers: Dict[Hashable, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._pumping = False
+
+    def subscribe(self, topic: Hashable, app: Flask) -> Subscription:
+        """Register for ``topic``; call within a request so the feed head is read with its session."""
+        sub = Subscription(topic, self.queue_size, changes.head())
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(sub)
+            if not self._pumping:
+                self._pumping = True
+                # Start from the new subscriber's position, not wherever the
+                # feed is by the time the thread runs
+                threading.Thread(target=self._pump, args=(app, sub.position), daemon=True).start()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.topic]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, topic: Hashable, event: Event) -> None:
+        with self._lock:
+            subs = list(self._subscribers.get(topic, ()))
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # Never block the pump on a slow client
+                sub.evicted = True
+                self.unsubscribe(sub)
+
+    def _pump(self, app: Flask, last: int) -> None:
+        with app.app_context():
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._pumping = False
+                        return
+                seen = changes.commit_count()
+                try:
+                    found, more = changes.changes_since(last)
+                except Exception:
+                    # Keep serving through a database hiccup; retry on the next tick
+                    app.logger.exception("appointment event pump failed")
+                    found, more = [], False
+                finally:
+                    db.session.rollback()
+                for change in found:
+                    event = (change.seq, self.encode(change))
+                    for topic in self.topics(change):
+                        self.publish(topic, event)
+                    last = change.seq
+                if not more:
+                    changes.wait_for_commit(seen, changes.POLL_INTERVAL)
@@ -0,0 +1,170 @@
+"""In-place upgrades for databases created before the current models.
+
+``db.create_all()`` only creates missing tables, so columns and indexes added
+to existing tables are applied here. Every step is idempotent and safe to run
+on each deploy, on both SQLite and PostgreSQL.
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from . import search, stats
+from .extensions import db
+from .geo import cell_id
+from .models import AppointmentCounter, Hospital
+
+
+def _add_column(table: str, column: str, ddl_type: str) -> bool:
+    columns = {c["name"] for c in inspect(db.engine).get_columns(table)}
+    if column in columns:
+        return False
+    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    return True
+
+
+def _has_table(table: str) -> bool:
+    return inspect(db.engine).has_table(table)
+
+
+def _create_index(name: str, table: str, columns: str, unique: bool = False, where: str = None) -> None:
+    ddl = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        ddl += f" WHERE {where}"
+    db.session.execute(text(ddl))
+
+
+def _drop_index(name: str) -> None:
+    db.session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _rebuild_sqlite_table(table: str) -> None:
+    """Recreate a SQLite table from its model definition, keeping its rows.
+
+    SQLite can't alter constraints in place. Follows the documented
+    create-copy-drop-rename sequence, so foreign keys of other tables that
+    reference ``table`` keep pointing at it. Relies on foreign key
+    enforcement being off, SQLite's default, so dropping the old table
+    doesn't cascade. Unique indexes are left to the caller, since existing
+    duplicates may need handling.
+    """
+    model = db.metadata.tables[table]
+    existing = {c["name"] for c in inspect(db.engine).get_columns(table)}
+    columns = ", ".join(c.name for c in model.columns if c.name in existing)
+    # AUTOINCREMENT high-water mark, which may be above the largest remaining id
+    sequence = db.session.execute(
+        text("SELECT seq FROM sqlite_sequence WHERE name = :t"), {"t": table}
+    ).scalar() if _has_table("sqlite_sequence") else None
+    ddl = str(CreateTable(model).compile(db.engine)).replace(f"CREATE TABLE {table} ", f"CREATE TABLE {table}_new ", 1)
+    db.session.execute(text(ddl))
+    db.session.execute(text(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}"))
+    db.session.execute(text(f"DROP TABLE {table}"))
+    db.session.execute(text(f"ALTER TABLE {table}_new RENAME TO {table}"))
+    if sequence is not None:
+        db.session.execute(text("UPDATE sqlite_sequence SET seq = MAX(seq, :s) WHERE name = :t"), {"s": sequence, "t": table})
+    for index in model.indexes:
+        if not index.unique:
+            index.create(db.session.connection(), checkfirst=True)
+
+
+def _sqlite_autoincrement(table: str, floor_query: str) -> None:
+    """Switch a SQLite table to AUTOINCREMENT, never handing out ids up to ``floor_query``'s result."""
+    ddl = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"), {"t": table}
+    ).scalar()
+    if "AUTOINCREMENT" in ddl.upper():
+        return
+    _rebuild_sqlite_table(table)
+    floor = db.session.execute(text(floor_query)).scalar() or 0
+    if not db.session.execute(text("UPDATE sqlite_sequence SET seq = MAX(seq, :s) WHERE name = :t"),
+                              {"s": floor, "t": table}).rowcount:
+        db.session.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:t, :s)"), {"s": floor, "t": table})
+
+
+def _cascade_foreign_key(table: str, column: str, referred: str) -> None:
+    """Make the foreign key on ``table.column`` delete its rows with the referred row."""
+    fk = next(
+        (fk for fk in inspect(db.engine).get_foreign_keys(table) if fk["constrained_columns"] == [column]), None
+    )
+    if fk is None or (fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE":
+        return
+    if db.engine.dialect.name == "sqlite":
+        _rebuild_sqlite_table(table)
+        return
+    columns = ", ".join(fk["referred_columns"])
+    db.session.execute(text(
+        f"ALTER TABLE {table} DROP CONSTRAINT {fk['name']}, "
+        f"ADD CONSTRAINT {fk['name']} FOREIGN KEY ({column}) REFERENCES {referred} ({columns}) ON DELETE CASCADE"
+    ))
+
+
+def _create_active_slot_index() -> None:
+    # Existing double bookings would make the unique index fail; report them
+    # instead of aborting the rest of the upgrade
+    try:
+        with db.session.begin_nested():
+            _create_index(
+                "uq_appointments_active_slot", "appointments", "doctor_id, date, time",
+                unique=True, where="status != 'CANCELLED'",
+            )
+    except IntegrityError:
+        print("WARNING: appointments has double-booked active slots; "
+              "cancel the duplicates and re-run to add uq_appointments_active_slot")
+
+
+def _backfill_hospital_cells() -> int:
+    rows = db.session.query(Hospital.hospital_id, Hospital.latitude, Hospital.longitude).filter(
+        Hospital.cell_id.is_(None),
+        Hospital.latitude.isnot(None),
+        Hospital.longitude.isnot(None),
+    ).all()
+    if rows:
+        db.session.execute(
+            Hospital.__table__.update()
+            .where(Hospital.hospital_id == db.bindparam("hid"))
+            .values(cell_id=db.bindparam("cid")),
+            [{"hid": hid, "cid": cell_id(lat, lon)} for hid, lat, lon in rows],
+        )
+    return len(rows)
+
+
+def upgrade() -> None:
+    db.create_all()
+
+    _add_column("hospitals", "cell_id", "BIGINT")
+    _create_index("ix_hospitals_cell_id", "hospitals", "cell_id")
+    _backfill_hospital_cells()
+
+    search.install()
+
+    _add_column("appointments", "row_version", "INTEGER NOT NULL DEFAULT 1")
+    if db.engine.dialect.name == "sqlite":
+        # Plain rowids reuse the ids of archived rows (PostgreSQL sequences don't)
+        _sqlite_autoincrement(
+            "appointments",
+            "SELECT MAX(appointment_id) FROM (SELECT appointment_id FROM appointments"
+            " UNION ALL SELECT appointment_id FROM appointments_archive)",
+        )
+    _create_active_slot_index()
+
+    # Access paths of the hot queries in routes/, see check_query_plans.py
+    _create_index("ix_doctors_user_id", "doctors", "user_id")
+    _create_index("ix_doctors_hospital_id", "doctors", "hospital_id")
+    _create_index("ix_doctors_specialization_lower", "doctors", "lower(specialization)")
+    _create_index("ix_hospital_admins_user_id", "hospital_admins", "user_id")
+    _create_index("ix_hospital_admins_hospital_id", "hospital_admins", "hospital_id")
+    _create_index("ix_doctor_schedules_doctor_day", "doctor_schedules", "doctor_id, day_of_week")
+    # Superseded by ix_appointments_doctor_slot, which also orders history pages by id
+    _drop_index("ix_appointments_doctor_date_time")
+    _create_index("ix_appointments_doctor_slot", "appointments", "doctor_id, date, time, appointment_id, status")
+    _create_index("ix_appointments_patient_date_time", "appointments", "patient_id, date, time")
+
+    _add_column("appointment_changes", "kind", "VARCHAR(16) NOT NULL DEFAULT 'updated'")
+    _cascade_foreign_key("appointment_changes", "appointment_id", "appointments")
+    _cascade_foreign_key("doctor_agendas", "doctor_id", "doctors")
+
+    _create_index("ix_appointments_archive_date", "appointments_archive", "date")
+    # Counters start empty on a new table; count everything once
+    if not db.session.query(AppointmentCounter.query.exists()).scalar():
+        stats.reconcile()
+
+    db.session.commit()
@@ -1,8 +1,9 @@
 from datetime import time, datetime
 from enum import Enum
 from typing import Optional
-from sqlalchemy import Enum as SqlEnum
+from sqlalchemy import Enum as SqlEnum, event, literal_column
 from .extensions import db
+from .geo import cell_id
 
 
 class UserType(str, Enum):
@@ -32,16 +33,25 @@ class Hospital(db.Model):
     longitude = db.Column(db.Float, nullable=True)
     fee_details = db.Column(db.String(255), nullable=True)
     phone = db.Column(db.String(50), nullable=True)
+    # Hierarchical spatial cell (see backend.geo.cell_id), kept in sync with
+    # latitude/longitude on every insert and update
+    cell_id = db.Column(db.BigInteger, nullable=True, index=True)
 
     doctors = db.relationship("Doctor", back_populates="hospital", cascade="all, delete-orphan")
     admin = db.relationship("HospitalAdmin", back_populates="hospital", uselist=False)
 
 
+@event.listens_for(Hospital, "before_insert")
+@event.listens_for(Hospital, "before_update")
+def _sync_hospital_cell(mapper, connection, target) -> None:
+    target.cell_id = cell_id(target.latitude, target.longitude)
+
+
 class HospitalAdmin(db.Model):
     __tablename__ = "hospital_admins"
     admin_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
-    hospital_id = db.Column(db.Integer, db.ForeignKey("hospitals.hospital_id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey("hospitals.hospital_id"), nullable=False, index=True)
     is_first_login = db.Column(db.Boolean, default=True)
 
     user = db.relationship("User", back_populates="hospital_admin")
@@ -51,8 +61,8 @@ class HospitalAdmin(db.Model):
 class Doctor(db.Model):
     __tablename__ = "doctors"
     doctor_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
-    hospital_id = db.Column(db.Integer, db.ForeignKey("hospitals.hospital_id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey("hospitals.hospital_id"), nullable=False, index=True)
     specialization = db.Column(db.String(255), nullable=False)
     qualifications = db.Column(db.String(255), nullable=True)
     experience_years = db.Column(db.Integer, nullable=True)
@@ -63,6 +73,11 @@ class Doctor(db.Model):
     schedules = db.relationship("DoctorSchedule", back_populates="doctor", cascade="all, delete-orphan")
     appointments = db.relationship("Appointment", back_populates="doctor", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Case-insensitive specialization filter on nearby/search lookups
+        db.Index("ix_doctors_specialization_lower", db.func.lower(specialization)),
+    )
+
 
 class DoctorSchedule(db.Model):
     __tablename__ = "doctor_schedules"
@@ -74,6 +89,10 @@ class DoctorSchedule(db.Model):
 
     doctor = db.relationship("Doctor", back_populates="schedules")
 
+    __table_args__ = (
+        db.Index("ix_doctor_schedules_doctor_day", "doctor_id", "day_of_week"),
+    )
+
 
 class AppointmentStatus(str, Enum):
     SCHEDULED = "Scheduled"
@@ -84,6 +103,23 @@ class AppointmentStatus(str, Enum):
 
 class Appointment(db.Model):
     __tablename__ = "appointments"
+    __table_args__ = (
+        # At most one active booking per doctor slot, enforced by the database
+        # so concurrent inserts cannot double-book
+        db.Index(
+            "uq_appointments_active_slot", "doctor_id", "date", "time", unique=True,
+            sqlite_where=db.text("status != 'CANCELLED'"),
+            postgresql_where=db.text("status != 'CANCELLED'"),
+        ),
+        # Doctor day views and keyset history pages in (date, time, appointment_id)
+        # order; status makes occupancy rebuilds and counts index-only
+        db.Index("ix_appointments_doctor_slot", "doctor_id", "date", "time", "appointment_id", "status"),
+        # Patient history ordered by date and time
+        db.Index("ix_appointments_patient_date_time", "patient_id", "date", "time"),
+        # Never reuse an id after the newest rows are archived; the archive
+        # keeps them
+        {"sqlite_autoincrement": True},
+    )
     appointment_id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey("doctors.doctor_id"), nullable=False)
@@ -93,5 +129,103 @@ class Appointment(db.Model):
     reason = db.Column(db.String(500), nullable=True)
     status = db.Column(SqlEnum(AppointmentStatus), default=AppointmentStatus.SCHEDULED, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped by every UPDATE, ORM or bulk, so cached encodings can be keyed on it
+    row_version = db.Column(db.Integer, nullable=False, default=1, server_default="1",
+                            onupdate=literal_column("row_version + 1"))
 
     doctor = db.relationship("Doctor", back_populates="appointments")
+
+
+class AppointmentChange(db.Model):
+    """Append-only log of appointment writes; ``seq`` orders the change feed."""
+
+    __tablename__ = "appointment_changes"
+    __table_args__ = (
+        db.Index("ix_appointment_changes_doctor_seq", "doctor_id", "seq"),
+        db.Index("ix_appointment_changes_patient_seq", "patient_id", "seq"),
+        # Never reuse a seq, even after the newest rows are deleted
+        {"sqlite_autoincrement": True},
+    )
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    # Entries go with their appointment, e.g. when a doctor is deleted
+    appointment_id = db.Column(
+        db.Integer, db.ForeignKey("appointments.appointment_id", ondelete="CASCADE"), nullable=False
+    )
+    doctor_id = db.Column(db.Integer, nullable=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    # "created" for the insert, "updated" for every later write
+    kind = db.Column(db.String(16), nullable=False, default="updated", server_default="updated")
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class IdempotencyRecord(db.Model):
+    """Stored outcome of a write request made with an ``Idempotency-Key`` header."""
+
+    __tablename__ = "idempotency_records"
+    # Endpoint and caller (or the request itself for anonymous callers), so
+    # keys from different users never collide
+    scope = db.Column(db.String(255), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # NULL while the first request is still running
+    status_code = db.Column(db.Integer, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class ArchivedAppointment(db.Model):
+    """Finished appointments moved out of ``appointments`` by ``backend.archive``.
+
+    Same columns and ids as the hot table, so rows read from either serialize
+    identically.
+    """
+
+    __tablename__ = "appointments_archive"
+    __table_args__ = (
+        db.Index("ix_appointments_archive_doctor_date_time", "doctor_id", "date", "time"),
+        db.Index("ix_appointments_archive_patient_date_time", "patient_id", "date", "time"),
+        # Day ranges for stats reconciliation
+        db.Index("ix_appointments_archive_date", "date"),
+    )
+    appointment_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    hospital_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    time = db.Column(db.Time, nullable=False)
+    reason = db.Column(db.String(500), nullable=True)
+    status = db.Column(SqlEnum(AppointmentStatus), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    row_version = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class DoctorAgenda(db.Model):
+    """A doctor's appointments for one day, pre-encoded by ``backend.agenda``.
+
+    Rebuilt in the transaction of every booking or status change touching
+    the day, so the stored payload always matches the committed rows.
+    """
+
+    __tablename__ = "doctor_agendas"
+    doctor_id = db.Column(db.Integer, db.ForeignKey("doctors.doctor_id", ondelete="CASCADE"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    # Bumped on every rebuild
+    version = db.Column(db.Integer, nullable=False, default=1)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class AppointmentCounter(db.Model):
+    """Appointments per status for one (hospital, day, doctor), kept current by ``backend.stats``."""
+
+    __tablename__ = "appointment_counters"
+    hospital_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    scheduled = db.Column(db.Integer, nullable=False, default=0)
+    confirmed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
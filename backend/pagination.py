@@ -0,0 +1,53 @@
+"""Opaque keyset cursors for paginated list endpoints.
+
+A cursor is the sort key of the last row a client received, JSON-encoded and
+wrapped in URL-safe base64. The next page resumes strictly after that key, so
+paging stays stable while rows are added and never pays for an OFFSET.
+"""
+
+import base64
+import json
+from typing import List, Optional
+
+from flask import request
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def encode_cursor(*key) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> List:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidPage("Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise InvalidPage("Invalid cursor")
+    return key
+
+
+def page_args(key_size: int):
+    """Read ``limit`` and ``cursor`` from the query string.
+
+    Returns (limit, after_key). ``limit`` is None when the client did not ask
+    for pagination; an explicit cursor without a limit uses DEFAULT_PAGE_SIZE.
+    """
+    limit = request.args.get("limit", type=int)
+    token = request.args.get("cursor")
+    if limit is not None and limit <= 0:
+        raise InvalidPage("limit must be positive")
+    if token and limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+    after: Optional[List] = decode_cursor(token, key_size) if token else None
+    return limit, after
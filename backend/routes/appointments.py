@@ -1,25 +1,107 @@
+import heapq
 from datetime import datetime, date, time as time_cls
-from flask import Blueprint, request
+from flask import Blueprint, Response, current_app, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import case, cast, literal, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from .. import agenda, changes, live, stats
 from ..extensions import db
-from ..models import Appointment, AppointmentStatus, Doctor, DoctorSchedule
+from ..idempotency import idempotent
+from ..models import Appointment, AppointmentStatus, ArchivedAppointment, Doctor, HospitalAdmin
+from ..pagination import InvalidPage, encode_cursor, page_args
+from ..slots import DEFAULT_SLOT_MINUTES, MAX_RANGE_DAYS, free_slots, occupancy, schedules
+from ..serialization import (
+    dumps, fragments, json_list, json_response, serialize_appointment, stream_json_list, stream_response,
+    streaming_requested,
+)
 
 appointments_bp = Blueprint("appointments", __name__)
 
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# History lives in the hot table and the archive; ids are unique across both
+HISTORY_MODELS = (Appointment, ArchivedAppointment)
+# Statuses that are never archived, so filtering on them skips the archive
+ACTIVE_STATUSES = {AppointmentStatus.SCHEDULED, AppointmentStatus.CONFIRMED}
+
+
+def appointment_fragments(keys) -> list:
+    """Return encoded appointments for (model, appointment_id, row_version) keys, in order.
+
+    Only rows whose current version is not cached are loaded and encoded.
+    Rows are looked up in the table they were read from; databases from
+    before ``appointments`` used AUTOINCREMENT can hold an id in both.
+    """
+    encoded = {
+        (model.__tablename__, aid): fragments.get((model.__tablename__, aid), version) for model, aid, version in keys
+    }
+    for model in HISTORY_MODELS:
+        missing = [aid for (table, aid), payload in encoded.items() if table == model.__tablename__ and payload is None]
+        if not missing:
+            continue
+        for a in model.query.filter(model.appointment_id.in_(missing)):
+            key = (model.__tablename__, a.appointment_id)
+            encoded[key] = fragments.get_or_build(key, a.row_version, lambda: serialize_appointment(a))
+    return [
+        encoded[(model.__tablename__, aid)] for model, aid, _ in keys
+        if encoded[(model.__tablename__, aid)] is not None
+    ]
+
+
+def is_slot_conflict(err: IntegrityError) -> bool:
+    """True when an insert failed on the active-slot unique index."""
+    message = str(err.orig)
+    return "uq_appointments_active_slot" in message or (
+        "UNIQUE constraint failed: appointments.doctor_id" in message
+    )
+
 
 def is_slot_available(doctor_id: int, when_date: date, when_time: time_cls) -> bool:
-    # Check schedule
-    schedules = DoctorSchedule.query.filter_by(doctor_id=doctor_id, day_of_week=when_date.weekday()).all()
-    within_schedule = any(s.start_time <= when_time < s.end_time for s in schedules)
-    if not within_schedule:
+    # Check schedule against the cached weekly windows
+    if not schedules.covers(doctor_id, when_date, when_time):
         return False
-    # Check conflicting appointment
-    conflict = Appointment.query.filter_by(doctor_id=doctor_id, date=when_date, time=when_time).first()
-    return conflict is None
+    # Check conflicting appointment against the occupancy bitmap; cancelled
+    # bookings free their slot. A set bit may be another worker's stale
+    # state, so it is confirmed before refusing; a stale clear bit is caught
+    # by the unique index on insert.
+    return not (
+        occupancy.is_booked(doctor_id, when_date, when_time)
+        and occupancy.confirm_booked(doctor_id, when_date, when_time)
+    )
+
+
+@appointments_bp.get("/doctors/<int:doctor_id>/slots")
+def list_free_slots(doctor_id: int):
+    try:
+        start = datetime.strptime(request.args.get("from") or date.today().isoformat(), "%Y-%m-%d").date()
+        end = datetime.strptime(request.args.get("to") or start.isoformat(), "%Y-%m-%d").date()
+    except ValueError:
+        return {"message": "Invalid date format"}, 400
+    slot_minutes = request.args.get("slot_minutes", DEFAULT_SLOT_MINUTES, type=int)
+    if not 5 <= slot_minutes <= 240:
+        return {"message": "slot_minutes must be between 5 and 240"}, 400
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        return {"message": f"Date range must span 1 to {MAX_RANGE_DAYS} days"}, 400
+
+    # At most two queries for the whole range (none when cached), then
+    # in-memory bit arithmetic
+    windows = schedules.windows(doctor_id)
+    booked = occupancy.get_range(doctor_id, start, end) if windows else {}
+    days = free_slots(windows, booked, start, end, slot_minutes, now=datetime.now())
+    return {
+        "doctor_id": doctor_id,
+        "slot_minutes": slot_minutes,
+        "days": [
+            {"date": day.isoformat(), "slots": [t.strftime("%H:%M") for t in free]}
+            for day, free in days
+        ],
+    }
 
 
 @appointments_bp.post("/appointments")
 @jwt_required()
+@idempotent()
 def create_appointment():
     data = request.get_json() or {}
     identity = get_jwt_identity() or {}
@@ -34,12 +116,19 @@ def create_appointment():
     if not all([patient_id, doctor_id, hospital_id, date_str, time_str]):
         return {"message": "Missing fields"}, 400
 
+    try:
+        doctor_id, hospital_id = int(doctor_id), int(hospital_id)
+    except (TypeError, ValueError):
+        return {"message": "Invalid doctor_id/hospital_id"}, 400
+
     try:
         when_date = datetime.strptime(date_str, "%Y-%m-%d").date()
         when_time = datetime.strptime(time_str, "%H:%M").time()
     except ValueError:
         return {"message": "Invalid date/time format"}, 400
 
+    # Cheap pre-check against the schedule and occupancy bitmap; the unique
+    # index on active slots settles any race between concurrent bookings
     if not is_slot_available(doctor_id, when_date, when_time):
         return {"message": "Selected slot is not available"}, 409
 
@@ -53,11 +142,88 @@ def create_appointment():
         status=AppointmentStatus.SCHEDULED,
     )
     db.session.add(appt)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if not is_slot_conflict(e):
+            raise
+        occupancy.book(doctor_id, when_date, when_time)
+        return {"message": "Selected slot is not available"}, 409
+    occupancy.book(appt.doctor_id, when_date, when_time)
 
     return {"appointment_id": appt.appointment_id}, 201
 
 
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def appointment_owner(user_id: int, identity: dict):
+    """(column, value) selecting the appointments a user sees: a doctor's bookings or a patient's own."""
+    # We don't have direct relation from user->doctor_id, so let client pass role via token
+    role = (identity.get("user_type") or "").lower()
+    if role == "doctor":
+        # find doctor id by user id
+        doctor = Doctor.query.filter_by(user_id=user_id).first()
+        return "doctor_id", doctor.doctor_id if doctor else None
+    return "patient_id", user_id
+
+
+def owned_appointments(owner, model=Appointment):
+    column, value = owner
+    return model.query.filter(getattr(model, column) == value)
+
+
+def _requested_statuses():
+    if not request.args.get("status"):
+        return None
+    try:
+        return {AppointmentStatus(v.strip()) for v in request.args["status"].split(",") if v.strip()}
+    except ValueError:
+        raise ValueError("Invalid status")
+
+
+def filter_appointments(q, model=Appointment, with_status: bool = True):
+    """Apply ``today``, ``from``/``to`` and ``status`` query-string filters.
+
+    ``status`` takes one or more comma separated values. Raises ValueError
+    with a client-facing message on bad input.
+    """
+    if request.args.get("today", "false").lower() == "true":
+        q = q.filter(model.date == date.today())
+    try:
+        if request.args.get("from"):
+            q = q.filter(model.date >= _parse_date(request.args["from"]))
+        if request.args.get("to"):
+            q = q.filter(model.date <= _parse_date(request.args["to"]))
+    except ValueError:
+        raise ValueError("Invalid date format")
+    statuses = _requested_statuses() if with_status else None
+    if statuses is not None:
+        q = q.filter(model.status.in_(statuses))
+    return q
+
+
+def history_queries(owner, with_status: bool = True):
+    """One filtered query per table that can hold matching rows, as (model, query) pairs."""
+    statuses = _requested_statuses() if with_status else None
+    models = (Appointment,) if statuses is not None and statuses <= ACTIVE_STATUSES else HISTORY_MODELS
+    return [(m, filter_appointments(owned_appointments(owner, m), m, with_status)) for m in models]
+
+
+def _slot_key(after: list):
+    """Decode a history cursor into its (date, time, appointment_id) sort key."""
+    try:
+        return (
+            _parse_date(after[0]),
+            datetime.strptime(after[1], "%H:%M:%S").time(),
+            int(after[2]),
+        )
+    except (TypeError, ValueError):
+        raise InvalidPage("Invalid cursor")
+
+
 @appointments_bp.get("/appointments/<int:user_id>")
 @jwt_required()
 def list_user_appointments(user_id: int):
@@ -65,38 +231,231 @@ def list_user_appointments(user_id: int):
     if user_id != identity.get("user_id"):
         return {"message": "Forbidden"}, 403
 
-    # Check if we should filter by today's date
-    filter_today = request.args.get('today', 'false').lower() == 'true'
-    today_date = date.today() if filter_today else None
+    try:
+        branches = history_queries(appointment_owner(user_id, identity))
+        limit, after = page_args(3)
+        after = _slot_key(after) if after is not None else None
+    except ValueError as e:
+        return {"message": str(e)}, 400
 
-    # For doctors, show their appointments; for patients, their own
-    # We don't have direct relation from user->doctor_id, so let client pass role via token
+    # (date, time, appointment_id) is unique, so the cursor resumes exactly
+    # after the last row sent; newest first with order=desc. Each table is
+    # read in key order on its own index and the sorted results are merged.
+    descending = request.args.get("order", "asc").lower() == "desc"
+    ordered = []
+    for model, q in branches:
+        columns = (model.date, model.time, model.appointment_id)
+        q = q.order_by(*(c.desc() if descending else c.asc() for c in columns))
+        if after is not None:
+            key = tuple_(*columns)
+            q = q.filter(key < after if descending else key > after)
+        ordered.append((model, q))
+
+    def merged_keys(take=None):
+        runs = []
+        for model, q in ordered:
+            q = q.with_entities(model.date, model.time, model.appointment_id, model.row_version)
+            rows = q.limit(take).all() if take is not None else q.all()
+            runs.append([(*row, model) for row in rows])
+        return list(heapq.merge(*runs, key=lambda r: r[:3], reverse=descending))
+
+    if limit is not None:
+        rows = merged_keys(limit + 1)
+        page = rows[:limit]
+        last = page[-1] if page and len(rows) > limit else None
+        return json_response(json_list(
+            "appointments",
+            appointment_fragments([(model, aid, version) for _, _, aid, version, model in page]),
+            next_cursor=encode_cursor(last[0].isoformat(), last[1].strftime("%H:%M:%S"), last[2]) if last else None,
+        ))
+
+    if streaming_requested():
+        rows = heapq.merge(
+            *(q.yield_per(STREAM_BATCH_SIZE) for _, q in ordered),
+            key=lambda a: (a.date, a.time, a.appointment_id), reverse=descending,
+        )
+        return stream_response(stream_json_list("appointments", (
+            fragments.get((a.__tablename__, a.appointment_id), a.row_version) or dumps(serialize_appointment(a))
+            for a in rows
+        )))
+
+    keys = [(model, aid, version) for _, _, aid, version, model in merged_keys()]
+    return json_response(json_list("appointments", appointment_fragments(keys)))
+
+
+@appointments_bp.get("/appointments/<int:user_id>/counts")
+@jwt_required()
+def count_user_appointments(user_id: int):
+    """Per-status totals for dashboards, counted by the database."""
+    identity = get_jwt_identity() or {}
+    if user_id != identity.get("user_id"):
+        return {"message": "Forbidden"}, 403
+
+    try:
+        branches = history_queries(appointment_owner(user_id, identity), with_status=False)
+    except ValueError as e:
+        return {"message": str(e)}, 400
+
+    # One conditional sum per status instead of GROUP BY status, which would
+    # sort the owner's rows; this way they are read once, in index order
+    counts = {s.value: 0 for s in AppointmentStatus}
+    for model, q in branches:
+        sums = q.with_entities(*(
+            db.func.sum(case((model.status == s, 1), else_=0)) for s in AppointmentStatus
+        )).one()
+        for s, n in zip(AppointmentStatus, sums):
+            counts[s.value] += n or 0
+    return {"counts": counts, "total": sum(counts.values())}
+
+
+@appointments_bp.get("/appointments/<int:user_id>/agenda")
+@jwt_required()
+def doctor_agenda(user_id: int):
+    """A doctor's appointments and per-status counts for one day (default today), from the materialized agenda."""
+    identity = get_jwt_identity() or {}
+    if user_id != identity.get("user_id") or (identity.get("user_type") or "").lower() != "doctor":
+        return {"message": "Forbidden"}, 403
+
+    try:
+        day = _parse_date(request.args["date"]) if request.args.get("date") else date.today()
+    except ValueError:
+        return {"message": "Invalid date format"}, 400
+
+    doctor_id = agenda.agendas.doctor_for_user(user_id)
+    if doctor_id is None:
+        return {"message": "Doctor not found"}, 404
+    return json_response(agenda.agendas.get(doctor_id, day))
+
+
+@appointments_bp.get("/appointments/changes")
+@jwt_required()
+def appointment_changes():
+    """Appointments created or updated after feed position ``since``.
+
+    With ``wait=<seconds>`` the request blocks until there is at least one
+    change or the timeout passes. Without ``since`` it returns no changes and
+    the current position, so a client can start following from now.
+    """
+    identity = get_jwt_identity() or {}
+    user_id = identity.get("user_id")
+    since = request.args.get("since", type=int)
+    wait = request.args.get("wait", 0, type=float)
+    if since is not None and since < 0:
+        return {"message": "since must be non-negative"}, 400
+    wait = max(0.0, min(wait, changes.MAX_WAIT_SECONDS))
+
+    if since is None:
+        return {"changes": [], "next": changes.head(), "more": False}
+
+    if (identity.get("user_type") or "").lower() == "doctor":
+        doctor = Doctor.query.filter_by(user_id=user_id).first()
+        if doctor is None:
+            return {"changes": [], "next": since, "more": False}
+        scope = {"doctor_id": doctor.doctor_id}
+    else:
+        scope = {"patient_id": user_id}
+
+    found, more = changes.poll(since, wait, **scope)
+    return {
+        "changes": [dict(serialize_appointment(c.appointment), seq=c.seq) for c in found],
+        "next": found[-1].seq if found else since,
+        "more": more,
+    }
+
+
+# Comment line sent on idle streams so proxies and clients keep them open
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def _event_frame(change: changes.Change) -> bytes:
+    a = change.appointment
+    if a.status == AppointmentStatus.CANCELLED:
+        kind = b"cancelled"
+    elif change.created:
+        kind = b"booked"
+    else:
+        kind = b"status_changed"
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (change.seq, kind, dumps(serialize_appointment(a)))
+
+
+appointment_events = live.Broadcaster(
+    encode=_event_frame,
+    topics=lambda c: (("doctor", c.appointment.doctor_id), ("hospital", c.appointment.hospital_id)),
+)
+
+
+def _may_follow(identity: dict, doctor_id, hospital_id) -> bool:
     role = (identity.get("user_type") or "").lower()
+    user_id = identity.get("user_id")
+    if role == "admin":
+        return True
     if role == "doctor":
-        # find doctor id by user id
         doctor = Doctor.query.filter_by(user_id=user_id).first()
-        doctor_id = doctor.doctor_id if doctor else None
-        q = Appointment.query.filter_by(doctor_id=doctor_id)
-    else:
-        q = Appointment.query.filter_by(patient_id=user_id)
-
-    # Filter by today's date if requested
-    if filter_today and today_date:
-        q = q.filter(Appointment.date == today_date)
-
-    appts = q.order_by(Appointment.date.asc(), Appointment.time.asc()).all()
-    return {"appointments": [
-        {
-            "appointment_id": a.appointment_id,
-            "patient_id": a.patient_id,
-            "doctor_id": a.doctor_id,
-            "hospital_id": a.hospital_id,
-            "date": a.date.isoformat(),
-            "time": a.time.strftime("%H:%M"),
-            "reason": a.reason,
-            "status": a.status.value,
-        } for a in appts
-    ]}
+        return doctor is not None and (doctor.doctor_id == doctor_id or doctor.hospital_id == hospital_id)
+    if role == "hospital admin" and hospital_id is not None:
+        return HospitalAdmin.query.filter_by(user_id=user_id, hospital_id=hospital_id).first() is not None
+    return False
+
+
+@appointments_bp.get("/appointments/stream")
+@jwt_required()
+def appointment_event_stream():
+    """Server-Sent Events for one doctor (``doctor_id=``) or hospital (``hospital_id=``).
+
+    Emits ``booked``, ``cancelled`` and ``status_changed`` events whose id is
+    the change feed seq. A reconnecting client sends ``Last-Event-ID`` (or
+    ``since=``) and first receives everything it missed.
+    """
+    doctor_id = request.args.get("doctor_id", type=int)
+    hospital_id = request.args.get("hospital_id", type=int)
+    if (doctor_id is None) == (hospital_id is None):
+        return {"message": "Pass exactly one of doctor_id or hospital_id"}, 400
+    if not _may_follow(get_jwt_identity() or {}, doctor_id, hospital_id):
+        return {"message": "Forbidden"}, 403
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+
+    topic = ("doctor", doctor_id) if doctor_id is not None else ("hospital", hospital_id)
+    # Subscribe before replaying so nothing committed in between is lost;
+    # live events already covered by the replay are skipped below. New
+    # clients replay from the feed head read at subscription.
+    sub = appointment_events.subscribe(topic, current_app._get_current_object())
+    if since is None:
+        since = sub.position
+    replay = []
+    try:
+        while since is not None:
+            found, more = changes.changes_since(since, doctor_id=doctor_id, hospital_id=hospital_id)
+            replay.extend(_event_frame(c) for c in found)
+            since = found[-1].seq if found else since
+            if not more:
+                break
+    except Exception:
+        appointment_events.unsubscribe(sub)
+        raise
+    replayed_to = since
+
+    def generate():
+        try:
+            yield b"retry: 3000\n\n"
+            yield from replay
+            while True:
+                try:
+                    event = sub.next(SSE_HEARTBEAT_SECONDS)
+                except EOFError:
+                    return  # evicted as a slow consumer; the client reconnects
+                if event is None:
+                    yield b": keepalive\n\n"
+                elif replayed_to is None or event[0] > replayed_to:
+                    yield event[1]
+        finally:
+            appointment_events.unsubscribe(sub)
+
+    # The generator never touches the database, so the request context (and
+    # its session) is released as soon as streaming starts
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @appointments_bp.put("/appointments/<int:appointment_id>")
@@ -113,6 +472,173 @@ def update_appointment_status(appointment_id: int):
         return {"message": "Invalid status"}, 400
 
     appt = Appointment.query.get_or_404(appointment_id)
+    old_status = appt.status
     appt.status = AppointmentStatus(new_status)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        # Re-activating a cancelled booking whose slot was taken since
+        db.session.rollback()
+        if not is_slot_conflict(e):
+            raise
+        return {"message": "Slot has been booked by another appointment"}, 409
+    _apply_occupancy([(appt.doctor_id, appt.date, appt.time, old_status, appt.status)])
     return {"message": "Updated"}
+
+
+# Upper bound on items in one bulk status request
+MAX_BULK_UPDATES = 500
+
+
+def _apply_occupancy(transitions) -> None:
+    """Mirror committed status changes into the occupancy bitmaps.
+
+    ``transitions`` holds (doctor_id, date, time, old_status, new_status).
+    """
+    for doctor_id, day, at, old, new in transitions:
+        if new == AppointmentStatus.CANCELLED and old != AppointmentStatus.CANCELLED:
+            occupancy.release(doctor_id, day, at)
+        elif old == AppointmentStatus.CANCELLED and new != AppointmentStatus.CANCELLED:
+            occupancy.book(doctor_id, day, at)
+
+
+@appointments_bp.put("/appointments/status")
+@jwt_required()
+def bulk_update_appointment_status():
+    """Apply many (appointment_id, status) changes in one transaction.
+
+    Body: {"updates": [{"appointment_id": 1, "status": "Completed"}, ...]}.
+    Returns one result per item, in request order. Valid items are written
+    with a single UPDATE; if that trips the active-slot index (re-activating
+    a cancelled booking whose slot was taken), items are retried one by one
+    so only the conflicting ones fail.
+    """
+    identity = get_jwt_identity() or {}
+    role = (identity.get("user_type") or "").lower()
+    if role != "doctor" and role != "admin":
+        return {"message": "Only doctors/admins can update appointments"}, 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {"message": "updates must be a list"}, 400
+    items = data.get("updates")
+    if not isinstance(items, list) or not items:
+        return {"message": "updates must be a non-empty list"}, 400
+    if len(items) > MAX_BULK_UPDATES:
+        return {"message": f"At most {MAX_BULK_UPDATES} updates per request"}, 400
+
+    results = []
+    wanted = {}
+    valid_statuses = {s.value for s in AppointmentStatus}
+    for item in items:
+        aid = item.get("appointment_id") if isinstance(item, dict) else None
+        status = item.get("status") if isinstance(item, dict) else None
+        if not isinstance(aid, int) or isinstance(aid, bool):
+            results.append({"appointment_id": aid, "status": 400, "message": "Invalid appointment_id"})
+        elif status not in valid_statuses:
+            results.append({"appointment_id": aid, "status": 400, "message": "Invalid status"})
+        else:
+            results.append({"appointment_id": aid, "status": None})
+            wanted[aid] = AppointmentStatus(status)  # last one wins for duplicates
+
+    # One query for existence, ownership and the current slot of every item
+    current = {}
+    owner = None
+    if role == "doctor":
+        doctor = Doctor.query.filter_by(user_id=identity.get("user_id")).first()
+        owner = doctor.doctor_id if doctor else None
+    if wanted:
+        rows = db.session.query(
+            Appointment.appointment_id, Appointment.doctor_id, Appointment.hospital_id, Appointment.date,
+            Appointment.time, Appointment.status,
+        ).filter(Appointment.appointment_id.in_(wanted))
+        current = {row.appointment_id: row for row in rows}
+
+    allowed = {}
+    for result in results:
+        aid = result["appointment_id"]
+        if result["status"] is not None:
+            continue
+        row = current.get(aid)
+        if row is None:
+            result.update(status=404, message="Appointment not found")
+        elif role == "doctor" and row.doctor_id != owner:
+            result.update(status=403, message="Forbidden")
+        else:
+            allowed[aid] = wanted[aid]
+
+    failed = {}
+    if allowed:
+        try:
+            db.session.execute(
+                update(Appointment)
+                .where(Appointment.appointment_id.in_(allowed))
+                # Cast each branch: PostgreSQL types a CASE of bare parameters
+                # as text, which it won't assign to the enum column
+                .values(status=case(
+                    {
+                        aid: cast(literal(status, Appointment.status.type), Appointment.status.type)
+                        for aid, status in allowed.items()
+                    },
+                    value=Appointment.appointment_id,
+                ))
+                .execution_options(synchronize_session=False)
+            )
+            changes.record_changes(allowed)
+            _track_bulk_writes(allowed, current)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_slot_conflict(e):
+                raise
+            failed = _update_one_by_one(allowed, current)
+
+    _apply_occupancy(
+        (current[aid].doctor_id, current[aid].date, current[aid].time, current[aid].status, new)
+        for aid, new in allowed.items() if aid not in failed
+    )
+    for result in results:
+        aid = result["appointment_id"]
+        if result["status"] is None:
+            if aid in failed:
+                result.update(status=409, message="Slot has been booked by another appointment")
+            else:
+                result.update(status=200, message="Updated")
+    return {"results": results}
+
+
+def _track_bulk_writes(updates, current) -> None:
+    """Mark the agendas and counters changed by a bulk status UPDATE, which skips the mapper events.
+
+    ``current`` maps appointment ids to their rows as read before the update.
+    """
+    agenda.touch(db.session, {(current[aid].doctor_id, current[aid].date) for aid in updates})
+    for aid, status in updates.items():
+        row = current[aid]
+        stats.moved(
+            db.session,
+            (row.hospital_id, row.date, row.doctor_id, row.status),
+            (row.hospital_id, row.date, row.doctor_id, status),
+        )
+
+
+def _update_one_by_one(updates, current) -> set:
+    """Apply each change in its own savepoint; return ids that hit a slot conflict."""
+    failed = set()
+    for aid, status in updates.items():
+        try:
+            with db.session.begin_nested():
+                db.session.execute(
+                    update(Appointment)
+                    .where(Appointment.appointment_id == aid)
+                    .values(status=status)
+                    .execution_options(synchronize_session=False)
+                )
+                changes.record_changes([aid])
+        except IntegrityError as e:
+            if not is_slot_conflict(e):
+                raise
+            failed.add(aid)
+    _track_bulk_writes({aid: status for aid, status in updates.items() if aid not in failed}, current)
+    db.session.commit()
+    return failed
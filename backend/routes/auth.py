@@ -1,13 +1,17 @@
+from datetime import timedelta
 from flask import Blueprint, request
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from passlib.hash import pbkdf2_sha256
 from ..extensions import db
+from ..idempotency import idempotent
 from ..models import User, UserType
 
 auth_bp = Blueprint("auth", __name__)
 
 
 @auth_bp.post("/register")
+# The stored response holds an access token; retries come within minutes
+@idempotent(ttl=timedelta(minutes=10))
 def register():
     data = request.get_json() or {}
     email = (data.get("email") or "").strip().lower()
@@ -1,7 +1,9 @@
+from datetime import date, datetime
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from .. import stats
 from ..extensions import db
-from ..models import User, Doctor, Hospital, HospitalAdmin, UserType
+from ..models import AppointmentStatus, User, Doctor, Hospital, HospitalAdmin, UserType
 
 hospital_admin_bp = Blueprint("hospital_admin", __name__)
 
@@ -212,4 +214,49 @@ def complete_first_login():
         return {"message": "First login setup completed"}
     except Exception as e:
         db.session.rollback()
-        return {"message": f"Error completing setup: {str(e)}"}, 500
\ No newline at end of file
+        return {"message": f"Error completing setup: {str(e)}"}, 500
+
+
+@hospital_admin_bp.get("/hospital-admin/stats")
+@jwt_required()
+def get_hospital_stats():
+    """Appointment counts per status for one day (default today), in total and per doctor.
+
+    Read from the counters kept by ``backend.stats``, so the cost does not
+    grow with the number of appointments.
+    """
+    identity = get_jwt_identity() or {}
+    user_id = identity.get("user_id")
+    
+    if not user_id:
+        return {"message": "Invalid token"}, 401
+    
+    # Verify user is hospital admin
+    user = User.query.get(user_id)
+    if not user or user.user_type != UserType.HOSPITAL_ADMIN:
+        return {"message": "Unauthorized - Hospital admin only"}, 403
+    
+    hospital_admin = HospitalAdmin.query.filter_by(user_id=user_id).first()
+    if not hospital_admin:
+        return {"message": "Hospital admin not found"}, 404
+    
+    try:
+        day = datetime.strptime(request.args["date"], "%Y-%m-%d").date() if request.args.get("date") else date.today()
+    except ValueError:
+        return {"message": "Invalid date format"}, 400
+    
+    totals = {s.value: 0 for s in AppointmentStatus}
+    doctors = []
+    for row in stats.hospital_day(hospital_admin.hospital_id, day):
+        counts = {s.value: getattr(row, column) for s, column in stats.COLUMNS.items()}
+        for status, n in counts.items():
+            totals[status] += n
+        doctors.append({"doctor_id": row.doctor_id, "counts": counts})
+    
+    return {
+        "hospital_id": hospital_admin.hospital_id,
+        "date": day.isoformat(),
+        "counts": totals,
+        "total": sum(totals.values()),
+        "doctors": doctors,
+    }
@@ -1,81 +1,320 @@
-from math import radians, cos, sin, asin, sqrt
+from datetime import date, datetime
+
+import numpy as np
 from flask import Blueprint, request
+from ..catalog import all_doctors_version, catalog_changed_at, catalog_version, doctor_version, get_snapshot
+from ..geo import cell_ranges, haversine_many, nearest_k, valid_coordinates
+from ..http_cache import conditional, make_etag
+from ..pagination import InvalidPage, encode_cursor, page_args
+from ..serialization import (
+    fragments, json_list, json_response, stream_json_list, stream_response, streaming_requested, with_member,
+)
 from ..extensions import db
-from ..models import Hospital, Doctor
+from ..models import Doctor
+from ..slots import DEFAULT_SLOT_MINUTES, MAX_RANGE_DAYS, earliest_free_slots
 
 hospitals_bp = Blueprint("hospitals", __name__)
 
 
-def haversine(lat1, lon1, lat2, lon2):
-    if None in (lat1, lon1, lat2, lon2):
-        return float("inf")
-    # convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    # haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c
-    return km
+def _catalog_validators():
+    return make_etag("hospitals", catalog_version()), catalog_changed_at()
+
+
+def _nearby_validators():
+    if not _doctor_filters_requested():
+        return _catalog_validators()
+    # Embedded doctors make the body depend on every hospital's doctor list
+    doctors, doctors_changed_at = all_doctors_version()
+    etag = make_etag("hospitals", catalog_version(), "doctors", doctors)
+    return etag, max(catalog_changed_at(), doctors_changed_at)
+
+
+def _doctor_filters_requested() -> bool:
+    return request.args.get("with_doctors", "").lower() in {"1", "true"} or bool(request.args.get("specialization"))
+
+
+def serialize_doctor(d: Doctor) -> dict:
+    return {
+        "doctor_id": d.doctor_id,
+        "user_id": d.user_id,
+        "hospital_id": d.hospital_id,
+        "specialization": d.specialization,
+        "qualifications": d.qualifications,
+        "is_available": d.is_available,
+    }
+
+
+def available_doctors(hospital_ids=None, specialization=None):
+    """Map hospital_id -> available doctors in one query.
+
+    Restricted to ``hospital_ids`` when given and to a case-insensitive
+    ``specialization`` match when given.
+    """
+    q = Doctor.query.filter(Doctor.is_available.is_(True))
+    if hospital_ids is not None:
+        q = q.filter(Doctor.hospital_id.in_(hospital_ids))
+    if specialization:
+        q = q.filter(db.func.lower(Doctor.specialization) == specialization.lower())
+    by_hospital = {}
+    for d in q.order_by(Doctor.hospital_id, Doctor.doctor_id):
+        by_hospital.setdefault(d.hospital_id, []).append(serialize_doctor(d))
+    return by_hospital
+
+
+def _doctor_validators(hospital_id: int):
+    version, changed_at = doctor_version(hospital_id)
+    return make_etag("doctors", hospital_id, version), changed_at
+
+
+def _after(distances, ids, last):
+    """Mask of rows ordered strictly after the (distance, hospital_id) key."""
+    last_dist, last_id = last
+    return (distances > last_dist) | ((distances == last_dist) & (ids > last_id))
+
+
+def _nearby_page(snapshot, lat, lon, take, k, radius_km, last, only=None):
+    """Return (distance_km or None, hospital_id) pairs for one page, nearest first.
+
+    ``take`` is None for an unbounded listing; ``last`` is the key of the last
+    row already served; ``only`` restricts results to a set of hospital ids.
+    Unlocated hospitals only appear in unbounded listings, after every located
+    one, with a None distance.
+    """
+    allowed = None
+    if only is not None:
+        allowed = np.isin(snapshot.ids, np.fromiter(only, dtype=np.int64, count=len(only)))
+    if radius_km is not None:
+        # Cell id ranges select the candidates by binary search, then exact
+        # distances drop the corners outside the circle
+        candidates = snapshot.in_cells(cell_ranges(lat, lon, radius_km))
+        ids = snapshot.ids[candidates]
+        distances = haversine_many(lat, lon, snapshot.lats[candidates], snapshot.lons[candidates])
+        mask = distances <= radius_km
+        if allowed is not None:
+            mask &= allowed[candidates]
+        if last is not None:
+            mask &= _after(distances, ids, last)
+        return [(float(distances[i]), int(ids[i])) for i in nearest_k(distances, mask, take)]
+
+    if k is not None:
+        return snapshot.grid.nearest(lat, lon, take, after=tuple(last) if last else None, only=only)
+
+    ranked = []
+    if last is None or last[0] is not None:
+        distances = haversine_many(lat, lon, snapshot.lats, snapshot.lons)
+        mask = snapshot.mask.copy()
+        if allowed is not None:
+            mask &= allowed
+        if last is not None:
+            mask &= _after(distances, snapshot.ids, last)
+        ranked = [(float(distances[i]), int(snapshot.ids[i])) for i in nearest_k(distances, mask, take)]
+    if take is None or len(ranked) < take:
+        # No bound requested: unlocated rows follow the ranked ones by id
+        unlocated = ~snapshot.mask
+        if allowed is not None:
+            unlocated &= allowed
+        if last is not None and last[0] is None:
+            unlocated &= snapshot.ids > last[1]
+        tail = snapshot.ids[unlocated]
+        if take is not None:
+            tail = tail[:take - len(ranked)]
+        ranked.extend((None, int(hid)) for hid in tail)
+    return ranked
 
 
 @hospitals_bp.get("/hospitals")
+@conditional(_catalog_validators)
 def list_hospitals():
-    hospitals = Hospital.query.all()
-    return {"hospitals": [
-        {
-            "hospital_id": h.hospital_id,
-            "name": h.name,
-            "address": h.address,
-            "latitude": h.latitude,
-            "longitude": h.longitude,
-            "fee_details": h.fee_details,
-            "phone": h.phone,
-        } for h in hospitals
-    ]}
+    try:
+        limit, after = page_args(1)
+    except InvalidPage as e:
+        return {"message": str(e)}, 400
+    snapshot = get_snapshot()
+    if limit is None:
+        if streaming_requested():
+            return stream_response(stream_json_list("hospitals", snapshot.fragments))
+        return json_response(snapshot.list_payload)
+
+    start = 0
+    if after is not None:
+        if not isinstance(after[0], int):
+            return {"message": "Invalid cursor"}, 400
+        start = int(np.searchsorted(snapshot.ids, after[0], side="right"))
+    page = snapshot.records[start:start + limit]
+    more = start + limit < len(snapshot.records)
+    return json_response(json_list(
+        "hospitals",
+        snapshot.fragments[start:start + limit],
+        next_cursor=encode_cursor(page[-1].hospital_id) if page and more else None,
+    ))
 
 
 @hospitals_bp.get("/hospitals/nearby")
+@conditional(_nearby_validators)
 def nearby_hospitals():
     try:
         lat = float(request.args.get("lat"))
         lon = float(request.args.get("lon"))
     except (TypeError, ValueError):
         return {"message": "lat and lon query params required"}, 400
+    if not valid_coordinates(lat, lon):
+        return {"message": "Invalid coordinates"}, 400
+
+    k = request.args.get("k", type=int)
+    radius_km = request.args.get("radius_km", type=float)
+    if (k is not None and k <= 0) or (radius_km is not None and radius_km <= 0):
+        return {"message": "k and radius_km must be positive"}, 400
+
+    # Cursor key: (distance_km, hospital_id, results left under k)
+    try:
+        limit, after = page_args(3)
+    except InvalidPage as e:
+        return {"message": str(e)}, 400
+    last = None
+    remaining = k
+    if after is not None:
+        last_dist, last_id, remaining = after
+        if not (isinstance(last_id, int)
+                and (last_dist is None or isinstance(last_dist, (int, float)))
+                and (remaining is None or isinstance(remaining, int))):
+            return {"message": "Invalid cursor"}, 400
+        last = (last_dist, last_id)
+
+    take = limit
+    if remaining is not None:
+        take = remaining if take is None else min(take, remaining)
+    # With a specialization filter one joined query finds the matching doctors
+    # up front and ranking is restricted to their hospitals
+    specialization = (request.args.get("specialization") or "").strip()
+    with_doctors = _doctor_filters_requested()
+    doctors = available_doctors(specialization=specialization) if specialization else None
+
+    # Look one row ahead to know whether another page exists
+    snapshot = get_snapshot()
+    ranked = _nearby_page(
+        snapshot, lat, lon, take + 1 if take is not None else None, k, radius_km, last,
+        only=set(doctors) if doctors is not None else None,
+    )
+    more = take is not None and len(ranked) > take
+    ranked = ranked[:take] if take is not None else ranked
+    if with_doctors and doctors is None:
+        doctors = available_doctors(hospital_ids=[hid for _, hid in ranked]) if ranked else {}
 
-    hospitals = Hospital.query.all()
-    enriched = []
-    for h in hospitals:
-        distance_km = haversine(lat, lon, h.latitude, h.longitude)
-        enriched.append((distance_km, h))
-    enriched.sort(key=lambda x: x[0])
-
-    return {"hospitals": [
-        {
-            "hospital_id": h.hospital_id,
-            "name": h.name,
-            "address": h.address,
-            "latitude": h.latitude,
-            "longitude": h.longitude,
-            "fee_details": h.fee_details,
-            "phone": h.phone,
-            "distance_km": round(dist, 2) if dist != float("inf") else None,
-        }
-        for dist, h in enriched
-    ]}
+    def item(dist, hid):
+        payload = with_member(snapshot.fragment_by_id[hid], "distance_km", round(dist, 2) if dist is not None else None)
+        if with_doctors:
+            payload = with_member(payload, "doctors", doctors.get(hid, []))
+        return payload
+
+    items = (item(dist, hid) for dist, hid in ranked)
+    if limit is None:
+        if streaming_requested():
+            return stream_response(stream_json_list("hospitals", items))
+        return json_response(json_list("hospitals", items))
+    left = remaining - len(ranked) if remaining is not None else None
+    next_cursor = None
+    if more and ranked and left != 0:
+        dist, hid = ranked[-1]
+        next_cursor = encode_cursor(dist, hid, left)
+    return json_response(json_list("hospitals", items, next_cursor=next_cursor))
 
 
 @hospitals_bp.get("/doctors/hospital/<int:hospital_id>")
+@conditional(_doctor_validators)
 def doctors_by_hospital(hospital_id: int):
-    doctors = Doctor.query.filter_by(hospital_id=hospital_id).all()
-    return {"doctors": [
-        {
-            "doctor_id": d.doctor_id,
-            "user_id": d.user_id,
-            "hospital_id": d.hospital_id,
-            "specialization": d.specialization,
-            "qualifications": d.qualifications,
-            "is_available": d.is_available,
-        } for d in doctors
-    ]}
+    def build():
+        doctors = Doctor.query.filter_by(hospital_id=hospital_id).all()
+        return {"doctors": [serialize_doctor(d) for d in doctors]}
+
+    version, _ = doctor_version(hospital_id)
+    return json_response(fragments.get_or_build(("doctors", hospital_id), version, build))
+
+
+MAX_FIRST_AVAILABLE = 50
+FIRST_AVAILABLE_DAYS = 14
+NEARBY_SLOT_RADIUS_KM = 10.0
+
+
+def _slot_search_args():
+    """Parse k, from, days and slot_minutes; raises ValueError with a client message."""
+    k = request.args.get("k", 1, type=int)
+    days = request.args.get("days", FIRST_AVAILABLE_DAYS, type=int)
+    slot_minutes = request.args.get("slot_minutes", DEFAULT_SLOT_MINUTES, type=int)
+    if not 1 <= k <= MAX_FIRST_AVAILABLE:
+        raise ValueError(f"k must be between 1 and {MAX_FIRST_AVAILABLE}")
+    if not 1 <= days <= MAX_RANGE_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_RANGE_DAYS}")
+    if not 5 <= slot_minutes <= 240:
+        raise ValueError("slot_minutes must be between 5 and 240")
+    try:
+        start = datetime.strptime(request.args.get("from") or date.today().isoformat(), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("Invalid date format")
+    return k, start, days, slot_minutes
+
+
+def _slot_item(at: datetime, doctor: dict) -> dict:
+    return {"date": at.date().isoformat(), "time": at.strftime("%H:%M"), "doctor": doctor}
+
+
+@hospitals_bp.get("/hospitals/<int:hospital_id>/first-available")
+def first_available_at_hospital(hospital_id: int):
+    """Earliest free slots across a hospital's available doctors."""
+    try:
+        k, start, days, slot_minutes = _slot_search_args()
+    except ValueError as e:
+        return {"message": str(e)}, 400
+    if hospital_id not in get_snapshot().by_id:
+        return {"message": "Hospital not found"}, 404
+
+    specialization = (request.args.get("specialization") or "").strip()
+    doctors = {
+        d["doctor_id"]: d
+        for d in available_doctors(hospital_ids=[hospital_id], specialization=specialization).get(hospital_id, [])
+    }
+    found = earliest_free_slots(list(doctors), k, start, days, slot_minutes, now=datetime.now())
+    return {"hospital_id": hospital_id, "slots": [_slot_item(at, doctors[did]) for at, did in found]}
+
+
+@hospitals_bp.get("/hospitals/nearby/first-available")
+def first_available_nearby():
+    """Earliest free slots across available doctors of hospitals within ``radius_km``.
+
+    Slots at the same time are ordered nearest hospital first.
+    """
+    try:
+        lat = float(request.args.get("lat"))
+        lon = float(request.args.get("lon"))
+    except (TypeError, ValueError):
+        return {"message": "lat and lon query params required"}, 400
+    if not valid_coordinates(lat, lon):
+        return {"message": "Invalid coordinates"}, 400
+    radius_km = request.args.get("radius_km", NEARBY_SLOT_RADIUS_KM, type=float)
+    if radius_km <= 0:
+        return {"message": "radius_km must be positive"}, 400
+    try:
+        k, start, days, slot_minutes = _slot_search_args()
+    except ValueError as e:
+        return {"message": str(e)}, 400
+
+    specialization = (request.args.get("specialization") or "").strip()
+    snapshot = get_snapshot()
+    if specialization:
+        by_hospital = available_doctors(specialization=specialization)
+        ranked = _nearby_page(snapshot, lat, lon, None, None, radius_km, None, only=set(by_hospital))
+    else:
+        ranked = _nearby_page(snapshot, lat, lon, None, None, radius_km, None)
+        by_hospital = available_doctors(hospital_ids=[hid for _, hid in ranked]) if ranked else {}
+
+    # Doctors nearest first, so equal slot times resolve to the closer hospital
+    distance = {hid: dist for dist, hid in ranked}
+    doctors = {d["doctor_id"]: d for _, hid in ranked for d in by_hospital.get(hid, [])}
+    found = earliest_free_slots(list(doctors), k, start, days, slot_minutes, now=datetime.now())
+
+    def item(at, doctor_id):
+        doctor = doctors[doctor_id]
+        hospital = dict(snapshot.by_id[doctor["hospital_id"]].to_dict(),
+                        distance_km=round(distance[doctor["hospital_id"]], 2))
+        return dict(_slot_item(at, doctor), hospital=hospital)
+
+    return {"slots": [item(at, doctor_id) for at, doctor_id in found]}
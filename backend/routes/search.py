@@ -0,0 +1,56 @@
+from flask import Blueprint, request
+from ..catalog import get_snapshot
+from ..geo import coordinate_arrays, haversine_many, valid_coordinates
+from ..search import search
+
+search_bp = Blueprint("search", __name__)
+
+MAX_RESULTS = 100
+
+
+@search_bp.get("/search")
+def search_catalog():
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return {"message": "q query param required"}, 400
+    limit = request.args.get("limit", 20, type=int)
+    if limit <= 0:
+        return {"message": "limit must be positive"}, 400
+    limit = min(limit, MAX_RESULTS)
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius_km = request.args.get("radius_km", type=float)
+    order = request.args.get("order", "relevance")
+    if order not in {"relevance", "distance"}:
+        return {"message": "order must be relevance or distance"}, 400
+    if (lat is None) != (lon is None) or ((order == "distance" or radius_km is not None) and lat is None):
+        return {"message": "lat and lon are required for distance ordering or radius_km"}, 400
+    if lat is not None and not valid_coordinates(lat, lon):
+        return {"message": "Invalid coordinates"}, 400
+
+    snapshot = get_snapshot()
+    hits = [h for h in search(query) if h.hospital_id in snapshot.by_id]
+    records = [snapshot.by_id[h.hospital_id] for h in hits]
+
+    distances = [None] * len(hits)
+    if lat is not None:
+        lats, lons, mask = coordinate_arrays([r.latitude for r in records], [r.longitude for r in records])
+        d = haversine_many(lat, lon, lats, lons)
+        distances = [float(x) if ok else None for x, ok in zip(d, mask)]
+
+    results = list(zip(hits, records, distances))
+    if radius_km is not None:
+        results = [row for row in results if row[2] is not None and row[2] <= radius_km]
+    if order == "distance":
+        # Relevance breaks ties; unlocated matches go last
+        results.sort(key=lambda row: (row[2] is None, row[2] or 0.0, -row[0].score))
+
+    return {"results": [
+        dict(
+            record.to_dict(),
+            score=round(hit.score, 4),
+            matched_specializations=hit.specializations,
+            distance_km=round(dist, 2) if dist is not None else None,
+        )
+        for hit, record, dist in results[:limit]
+    ]}
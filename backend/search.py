@@ -0,0 +1,124 @@
+"""Full-text search over hospital names/addresses and doctor specializations.
+
+SQLite uses FTS5 external-content tables kept in sync by triggers; PostgreSQL
+uses GIN indexes on ``to_tsvector`` expressions, so no extra tables or
+extensions are needed there. Both backends answer a query with indexed
+lookups and return one relevance score per hospital (higher is better).
+"""
+
+import re
+from typing import Dict, List, NamedTuple
+
+from sqlalchemy import text
+from .extensions import db
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS hospitals_fts USING fts5("
+    "name, address, content='hospitals', content_rowid='hospital_id')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS doctors_fts USING fts5("
+    "specialization, content='doctors', content_rowid='doctor_id')",
+    """CREATE TRIGGER IF NOT EXISTS hospitals_fts_ai AFTER INSERT ON hospitals BEGIN
+        INSERT INTO hospitals_fts(rowid, name, address) VALUES (new.hospital_id, new.name, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hospitals_fts_ad AFTER DELETE ON hospitals BEGIN
+        INSERT INTO hospitals_fts(hospitals_fts, rowid, name, address)
+        VALUES ('delete', old.hospital_id, old.name, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hospitals_fts_au AFTER UPDATE OF name, address ON hospitals BEGIN
+        INSERT INTO hospitals_fts(hospitals_fts, rowid, name, address)
+        VALUES ('delete', old.hospital_id, old.name, old.address);
+        INSERT INTO hospitals_fts(rowid, name, address) VALUES (new.hospital_id, new.name, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS doctors_fts_ai AFTER INSERT ON doctors BEGIN
+        INSERT INTO doctors_fts(rowid, specialization) VALUES (new.doctor_id, new.specialization);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS doctors_fts_ad AFTER DELETE ON doctors BEGIN
+        INSERT INTO doctors_fts(doctors_fts, rowid, specialization)
+        VALUES ('delete', old.doctor_id, old.specialization);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS doctors_fts_au AFTER UPDATE OF specialization ON doctors BEGIN
+        INSERT INTO doctors_fts(doctors_fts, rowid, specialization)
+        VALUES ('delete', old.doctor_id, old.specialization);
+        INSERT INTO doctors_fts(rowid, specialization) VALUES (new.doctor_id, new.specialization);
+    END""",
+]
+
+# The indexed expressions must match the ones used in _POSTGRES_QUERY exactly
+_POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_hospitals_fts ON hospitals "
+    "USING GIN (to_tsvector('simple', name || ' ' || address))",
+    "CREATE INDEX IF NOT EXISTS ix_doctors_fts ON doctors "
+    "USING GIN (to_tsvector('simple', specialization))",
+]
+
+_SQLITE_QUERY = """
+    SELECT rowid AS hospital_id, -bm25(hospitals_fts) AS score, NULL AS specialization
+    FROM hospitals_fts WHERE hospitals_fts MATCH :q
+    UNION ALL
+    SELECT d.hospital_id, -bm25(doctors_fts), d.specialization
+    FROM doctors_fts JOIN doctors d ON d.doctor_id = doctors_fts.rowid
+    WHERE doctors_fts MATCH :q
+"""
+
+_POSTGRES_QUERY = """
+    SELECT hospital_id, ts_rank(to_tsvector('simple', name || ' ' || address), to_tsquery('simple', :q)) AS score,
+           NULL AS specialization
+    FROM hospitals WHERE to_tsvector('simple', name || ' ' || address) @@ to_tsquery('simple', :q)
+    UNION ALL
+    SELECT hospital_id, ts_rank(to_tsvector('simple', specialization), to_tsquery('simple', :q)), specialization
+    FROM doctors WHERE to_tsvector('simple', specialization) @@ to_tsquery('simple', :q)
+"""
+
+
+class SearchHit(NamedTuple):
+    hospital_id: int
+    score: float
+    specializations: List[str]
+
+
+def install() -> None:
+    """Create the text indexes for the current dialect. Idempotent."""
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'hospitals_fts'")
+        ).first()
+        for ddl in _SQLITE_DDL:
+            db.session.execute(text(ddl))
+        if not exists:
+            # Index rows that predate the FTS tables
+            db.session.execute(text("INSERT INTO hospitals_fts(hospitals_fts) VALUES ('rebuild')"))
+            db.session.execute(text("INSERT INTO doctors_fts(doctors_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for ddl in _POSTGRES_DDL:
+            db.session.execute(text(ddl))
+
+
+def _match_expression(tokens: List[str], dialect: str) -> str:
+    # Every token must match, each as a prefix so partial words still hit
+    if dialect == "postgresql":
+        return " & ".join(f"{t}:*" for t in tokens)
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def search(query: str) -> List[SearchHit]:
+    """Return hospitals matching every term of ``query``, best first."""
+    tokens = [t.lower() for t in _TOKEN.findall(query)]
+    if not tokens:
+        return []
+    dialect = db.engine.dialect.name
+    sql = _POSTGRES_QUERY if dialect == "postgresql" else _SQLITE_QUERY
+    rows = db.session.execute(text(sql), {"q": _match_expression(tokens, dialect)}).all()
+
+    hits: Dict[int, SearchHit] = {}
+    for hospital_id, score, specialization in rows:
+        hit = hits.get(hospital_id)
+        if hit is None:
+            hit = hits[hospital_id] = SearchHit(hospital_id, float(score), [])
+        elif score > hit.score:
+            hit = hits[hospital_id] = hit._replace(score=float(score))
+        if specialization and specialization not in hit.specializations:
+            hit.specializations.append(specialization)
+    return sorted(hits.values(), key=lambda h: (-h.score, h.hospital_id))
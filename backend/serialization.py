@@ -0,0 +1,132 @@
+"""Pre-serialized JSON for read endpoints.
+
+Entities are encoded once per version into byte fragments, kept in a bounded
+LRU, and list responses are stitched together from those fragments instead
+of re-encoding every row on every request. ``orjson`` is used when it is
+installed; the standard library encoder is the fallback.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Iterator, Optional
+
+from flask import Response, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def serialize_appointment(a) -> dict:
+    """JSON shape of an appointment; ``a`` may be a model instance or a row with the same columns."""
+    return {
+        "appointment_id": a.appointment_id,
+        "patient_id": a.patient_id,
+        "doctor_id": a.doctor_id,
+        "hospital_id": a.hospital_id,
+        "date": a.date.isoformat(),
+        "time": a.time.strftime("%H:%M"),
+        "reason": a.reason,
+        "status": a.status.value,
+    }
+
+
+def with_member(fragment: bytes, name: str, value) -> bytes:
+    """Append one member to an encoded JSON object fragment."""
+    return b"".join((fragment[:-1], b",", dumps(name), b":", dumps(value), b"}"))
+
+
+def json_list(name: str, fragments: Iterable[bytes], **members) -> bytes:
+    """Stitch ``{"name": [fragments...], **members}`` without re-encoding the items."""
+    parts = [b"{", dumps(name), b":[", b",".join(fragments), b"]"]
+    for key, value in members.items():
+        parts += [b",", dumps(key), b":", dumps(value)]
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+def json_response(payload: bytes, status: int = 200) -> Response:
+    return Response(payload, status=status, mimetype="application/json")
+
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def streaming_requested() -> bool:
+    return request.args.get("stream", "").lower() in {"1", "true"}
+
+
+def stream_json_list(name: str, items: Iterable[bytes], **members) -> Iterator[bytes]:
+    """Yield ``{"name": [items...], **members}`` in chunks of about STREAM_CHUNK_BYTES.
+
+    Only one chunk is buffered at a time, so memory stays flat however many
+    items the iterable produces.
+    """
+    buf = [b"{", dumps(name), b":["]
+    size = 0
+    first = True
+    for item in items:
+        if not first:
+            buf.append(b",")
+        first = False
+        buf.append(item)
+        size += len(item) + 1
+        if size >= STREAM_CHUNK_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    buf.append(b"]")
+    for key, value in members.items():
+        buf += [b",", dumps(key), b":", dumps(value)]
+    buf.append(b"}")
+    yield b"".join(buf)
+
+
+def stream_response(chunks: Iterator[bytes]) -> Response:
+    """Send a chunked body; the request context (and DB session) stays open while it streams."""
+    return Response(stream_with_context(chunks), mimetype="application/json")
+
+
+class FragmentCache:
+    """Thread-safe LRU of encoded fragments keyed by (key, version)."""
+
+    def __init__(self, maxsize: int = 20000):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: Hashable, version, payload: bytes) -> bytes:
+        with self._lock:
+            self._items[key] = (version, payload)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return payload
+
+    def get_or_build(self, key: Hashable, version, build: Callable[[], object]) -> bytes:
+        payload = self.get(key, version)
+        if payload is None:
+            payload = self.put(key, version, dumps(build()))
+        return payload
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+fragments = FragmentCache()
@@ -0,0 +1,413 @@
+"""Appointment slot arithmetic.
+
+Slots are computed in memory from a doctor's weekly schedule windows and a
+per-day occupancy bitmap, so a whole calendar view costs at most three queries
+no matter how many slots it shows.
+
+Occupancy is a Python int per (doctor_id, date) with bit ``m`` set when an
+active appointment starts at minute ``m`` of the day. ``occupancy`` keeps
+these bitmaps in memory; booking and status changes update them after commit
+and the database is only read to rebuild a missing or expired day. Days
+changed by other processes are dropped by following the appointment change
+feed, at most once per ``sync_interval``.
+``schedules`` does the same for weekly schedule windows, which are dropped
+whenever a commit touches a doctor's schedule rows.
+"""
+
+import heapq
+import threading
+import time as clock
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import islice
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from . import changes
+from .extensions import db
+from .models import Appointment, AppointmentStatus, DoctorSchedule
+
+Window = Tuple[time, time]
+
+DEFAULT_SLOT_MINUTES = 30
+MAX_RANGE_DAYS = 31
+
+
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def _time(minutes: int) -> time:
+    return time(minutes // 60, minutes % 60)
+
+
+def load_windows(doctor_id: int) -> Dict[int, List[Window]]:
+    """Return weekday (0=Mon) -> sorted (start, end) schedule windows."""
+    windows: Dict[int, List[Window]] = {}
+    for s in DoctorSchedule.query.filter_by(doctor_id=doctor_id):
+        windows.setdefault(s.day_of_week, []).append((s.start_time, s.end_time))
+    for day in windows.values():
+        day.sort()
+    return windows
+
+
+class WeeklySchedule(NamedTuple):
+    """Per-weekday windows of one doctor, indexed 0=Mon..6=Sun.
+
+    ``windows`` keeps the rows as stored (slot listing steps through each
+    one); ``merged`` joins overlapping windows so containment is one bisect.
+    """
+    windows: Tuple[Tuple[Window, ...], ...]
+    merged: Tuple[Tuple[Window, ...], ...]
+    starts: Tuple[Tuple[time, ...], ...]
+
+    @classmethod
+    def build(cls, windows: Dict[int, List[Window]]) -> "WeeklySchedule":
+        days = tuple(tuple(windows.get(day, ())) for day in range(7))
+        merged = []
+        for day in days:
+            joined: List[Window] = []
+            for start, end in day:
+                if joined and start <= joined[-1][1]:
+                    joined[-1] = (joined[-1][0], max(joined[-1][1], end))
+                else:
+                    joined.append((start, end))
+            merged.append(tuple(joined))
+        return cls(days, tuple(merged), tuple(tuple(w[0] for w in day) for day in merged))
+
+    def as_dict(self) -> Dict[int, List[Window]]:
+        return {day: list(w) for day, w in enumerate(self.windows) if w}
+
+    def covers(self, day: date, at: time) -> bool:
+        weekday = day.weekday()
+        i = bisect_right(self.starts[weekday], at) - 1
+        return i >= 0 and at < self.merged[weekday][i][1]
+
+
+class ScheduleCache:
+    """Process-local ``WeeklySchedule`` per doctor.
+
+    Entries are dropped after a commit that writes the doctor's schedule rows
+    and expire after ``ttl`` seconds so edits made by other processes show up.
+    """
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[int, Tuple[float, WeeklySchedule]]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, doctor_id: int) -> WeeklySchedule:
+        now = clock.monotonic()
+        with self._lock:
+            item = self._items.get(doctor_id)
+            if item is not None and now - item[0] <= self.ttl:
+                self._items.move_to_end(doctor_id)
+                return item[1]
+            generation = (self._epoch, self._generations.get(doctor_id, 0))
+        schedule = WeeklySchedule.build(load_windows(doctor_id))
+        with self._lock:
+            # Don't cache rows read before a concurrent invalidation
+            if (self._epoch, self._generations.get(doctor_id, 0)) == generation:
+                self._items[doctor_id] = (now, schedule)
+                self._items.move_to_end(doctor_id)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return schedule
+
+    def get_many(self, doctor_ids: Sequence[int]) -> Dict[int, WeeklySchedule]:
+        """Schedules for several doctors; all misses are loaded in one query."""
+        now = clock.monotonic()
+        found: Dict[int, WeeklySchedule] = {}
+        with self._lock:
+            for doctor_id in doctor_ids:
+                item = self._items.get(doctor_id)
+                if item is not None and now - item[0] <= self.ttl:
+                    self._items.move_to_end(doctor_id)
+                    found[doctor_id] = item[1]
+            missing = [d for d in doctor_ids if d not in found]
+            generations = {d: (self._epoch, self._generations.get(d, 0)) for d in missing}
+        if missing:
+            loaded = load_windows_many(missing)
+            with self._lock:
+                for doctor_id in missing:
+                    found[doctor_id] = schedule = WeeklySchedule.build(loaded[doctor_id])
+                    if (self._epoch, self._generations.get(doctor_id, 0)) == generations[doctor_id]:
+                        self._items[doctor_id] = (now, schedule)
+                        self._items.move_to_end(doctor_id)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return found
+
+    def windows(self, doctor_id: int) -> Dict[int, List[Window]]:
+        return self.get(doctor_id).as_dict()
+
+    def covers(self, doctor_id: int, day: date, at: time) -> bool:
+        return self.get(doctor_id).covers(day, at)
+
+    def invalidate(self, doctor_ids: Iterable[int]) -> None:
+        with self._lock:
+            for doctor_id in doctor_ids:
+                self._generations[doctor_id] = self._generations.get(doctor_id, 0) + 1
+                self._items.pop(doctor_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._items.clear()
+
+
+schedules = ScheduleCache()
+
+
+def _mark_schedule_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    # A window moved to another doctor invalidates both
+    doctor_ids = {target.doctor_id, *inspect(target).attrs.doctor_id.history.deleted}
+    session.info.setdefault("schedule_doctors_changed", set()).update(d for d in doctor_ids if d is not None)
+
+
+for _evt in ("after_insert", "after_update", "after_delete"):
+    event.listen(DoctorSchedule, _evt, _mark_schedule_changed)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_schedule_write(state) -> None:
+    # Query.update()/delete() bypass the mapper events; the rows they touch
+    # aren't known, so drop every cached schedule on commit
+    if (state.is_update or state.is_delete) and state.bind_mapper is inspect(DoctorSchedule):
+        state.session.info["schedules_bulk_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session) -> None:
+    changed = session.info.pop("schedule_doctors_changed", None)
+    if session.info.pop("schedules_bulk_changed", False):
+        schedules.clear()
+    elif changed:
+        schedules.invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("schedule_doctors_changed", None)
+    session.info.pop("schedules_bulk_changed", None)
+
+
+def load_windows_many(doctor_ids: Iterable[int]) -> Dict[int, Dict[int, List[Window]]]:
+    """``load_windows`` for several doctors in one query."""
+    by_doctor: Dict[int, Dict[int, List[Window]]] = {d: {} for d in doctor_ids}
+    if by_doctor:
+        for s in DoctorSchedule.query.filter(DoctorSchedule.doctor_id.in_(by_doctor)):
+            by_doctor[s.doctor_id].setdefault(s.day_of_week, []).append((s.start_time, s.end_time))
+    for windows in by_doctor.values():
+        for day in windows.values():
+            day.sort()
+    return by_doctor
+
+
+def load_booked(doctor_id: int, start: date, end: date) -> Dict[date, int]:
+    """Return date -> occupancy bitmap for active appointments in [start, end]."""
+    rows = db.session.query(Appointment.date, Appointment.time).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.date >= start,
+        Appointment.date <= end,
+        Appointment.status != AppointmentStatus.CANCELLED,
+    )
+    booked: Dict[date, int] = {}
+    for day, at in rows:
+        booked[day] = booked.get(day, 0) | (1 << _minutes(at))
+    return booked
+
+
+class OccupancyCache:
+    """LRU of per-(doctor, day) occupancy bitmaps with write-through updates.
+
+    Days that other processes write are dropped when the change feed shows
+    them, checked at most every ``sync_interval`` seconds; ``ttl`` is the
+    backstop. A bitmap can still be that far behind, so a set bit is
+    confirmed with ``confirm_booked`` before a booking is refused. A
+    per-doctor write generation stops a rebuild that raced with a local
+    booking from caching the pre-booking state.
+    """
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 300.0, sync_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._items: "OrderedDict[Tuple[int, date], Tuple[float, int]]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._feed_position: Optional[int] = None
+        self._synced_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        now = clock.monotonic()
+        with self._lock:
+            if now - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = now
+            position = self._feed_position
+        if position is None:
+            # Nothing cached yet predates the current head
+            changed, position = set(), changes.head()
+        else:
+            changed, position = changes.days_changed_since(position)
+        with self._lock:
+            self._feed_position = position
+            for doctor_id, day in changed:
+                self._generations[doctor_id] = self._generations.get(doctor_id, 0) + 1
+                self._items.pop((doctor_id, day), None)
+
+    def _cached(self, doctor_id: int, day: date, now: float) -> Optional[int]:
+        item = self._items.get((doctor_id, day))
+        if item is None or now - item[0] > self.ttl:
+            return None
+        self._items.move_to_end((doctor_id, day))
+        return item[1]
+
+    def get_range(self, doctor_id: int, start: date, end: date) -> Dict[date, int]:
+        """Bitmaps for every day in [start, end]; misses are rebuilt in one query."""
+        self._sync()
+        now = clock.monotonic()
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        with self._lock:
+            found = {day: self._cached(doctor_id, day, now) for day in days}
+            generation = self._generations.get(doctor_id, 0)
+        missing = [day for day, bits in found.items() if bits is None]
+        if missing:
+            loaded = load_booked(doctor_id, missing[0], missing[-1])
+            with self._lock:
+                fresh = self._generations.get(doctor_id, 0) == generation
+                for day in missing:
+                    found[day] = loaded.get(day, 0)
+                    if fresh:
+                        self._items[(doctor_id, day)] = (now, found[day])
+                        self._items.move_to_end((doctor_id, day))
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return found
+
+    def get(self, doctor_id: int, day: date) -> int:
+        return self.get_range(doctor_id, day, day)[day]
+
+    def is_booked(self, doctor_id: int, day: date, at: time) -> bool:
+        return bool(self.get(doctor_id, day) >> _minutes(at) & 1)
+
+    def confirm_booked(self, doctor_id: int, day: date, at: time) -> bool:
+        """Check a cached booking against the database; clears the bit if it was stale."""
+        booked = db.session.query(Appointment.query.filter(
+            Appointment.doctor_id == doctor_id,
+            Appointment.date == day,
+            Appointment.time == at,
+            Appointment.status != AppointmentStatus.CANCELLED,
+        ).exists()).scalar()
+        if not booked:
+            self.release(doctor_id, day, at)
+        return booked
+
+    def _update(self, doctor_id: int, day: date, at: time, booked: bool) -> None:
+        bit = 1 << _minutes(at)
+        with self._lock:
+            self._generations[doctor_id] = self._generations.get(doctor_id, 0) + 1
+            item = self._items.get((doctor_id, day))
+            if item is not None:
+                bits = item[1] | bit if booked else item[1] & ~bit
+                self._items[(doctor_id, day)] = (item[0], bits)
+
+    def book(self, doctor_id: int, day: date, at: time) -> None:
+        self._update(doctor_id, day, at, True)
+
+    def release(self, doctor_id: int, day: date, at: time) -> None:
+        self._update(doctor_id, day, at, False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+occupancy = OccupancyCache()
+
+
+def day_slots(windows: Iterable[Window], slot_minutes: int) -> List[int]:
+    """Slot start minutes that fit entirely inside the schedule windows."""
+    starts: List[int] = []
+    for start, end in windows:
+        t, stop = _minutes(start), _minutes(end)
+        while t + slot_minutes <= stop:
+            starts.append(t)
+            t += slot_minutes
+    return sorted(set(starts))
+
+
+def free_slots(windows: Dict[int, List[Window]], booked: Dict[date, int], start: date, end: date,
+               slot_minutes: int = DEFAULT_SLOT_MINUTES, now: Optional[datetime] = None) -> List[Tuple[date, List[time]]]:
+    """Return (date, free slot starts) for every day in [start, end].
+
+    A slot is free when no active booking starts inside it, which is one AND
+    against the day's bitmap. Slots that have already started relative to
+    ``now`` are left out.
+    """
+    span = (1 << slot_minutes) - 1
+    days = []
+    day = start
+    while day <= end:
+        bits = booked.get(day, 0)
+        cutoff = _minutes(now.time()) if now is not None and day == now.date() else None
+        free = []
+        for t in day_slots(windows.get(day.weekday(), ()), slot_minutes):
+            if now is not None and (day < now.date() or (cutoff is not None and t < cutoff)):
+                continue
+            if bits >> t & span:
+                continue
+            free.append(_time(t))
+        days.append((day, free))
+        day += timedelta(days=1)
+    return days
+
+
+def iter_free_slots(doctor_id: int, schedule: WeeklySchedule, start: date, days: int,
+                    slot_minutes: int = DEFAULT_SLOT_MINUTES, now: Optional[datetime] = None) -> Iterator[datetime]:
+    """Yield a doctor's free slot starts in time order over ``days`` days from ``start``.
+
+    A day's occupancy is only read when the consumer reaches that day and the
+    doctor works on it, so stopping early reads no further booking rows.
+    """
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        windows = schedule.windows[day.weekday()]
+        if not windows or (now is not None and day < now.date()):
+            continue
+        booked = {day: occupancy.get(doctor_id, day)}
+        _, free = free_slots({day.weekday(): list(windows)}, booked, day, day, slot_minutes, now)[0]
+        for t in free:
+            yield datetime.combine(day, t)
+
+
+def _tagged(rank: int, doctor_id: int, slots: Iterator[datetime]) -> Iterator[Tuple[datetime, int, int]]:
+    for at in slots:
+        yield at, rank, doctor_id
+
+
+def earliest_free_slots(doctor_ids: Sequence[int], k: int, start: date, days: int,
+                        slot_minutes: int = DEFAULT_SLOT_MINUTES,
+                        now: Optional[datetime] = None) -> List[Tuple[datetime, int]]:
+    """The ``k`` earliest (slot start, doctor_id) pairs across ``doctor_ids``.
+
+    Each doctor's slots are a lazy sorted stream; a heap merge pulls from
+    whichever stream is earliest and stops after ``k`` results. Ties go to
+    the doctor listed first.
+    """
+    weekly = schedules.get_many(doctor_ids)
+    streams = [
+        _tagged(rank, doctor_id, iter_free_slots(doctor_id, weekly[doctor_id], start, days, slot_minutes, now))
+        for rank, doctor_id in enumerate(doctor_ids)
+    ]
+    return [(at, doctor_id) for at, _, doctor_id in islice(heapq.merge(*streams), k)]
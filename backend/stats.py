@@ -0,0 +1,152 @@
+"""Per-hospital, per-day appointment counters for the admin dashboard.
+
+``appointment_counters`` holds one row per (hospital, day, doctor) with a
+count per status. Appointment writes add their deltas just before the
+transaction commits, as increment-only upserts, so concurrent writers never
+overwrite each other. Bulk UPDATEs bypass the mapper events and call
+``moved`` themselves.
+
+``reconcile`` compares the counters with ``appointments`` and the archive
+and adds whatever drift it finds; ``reconcile_stats.py`` runs it
+periodically. Archiving moves rows between tables without touching the
+counters, so history stays counted.
+"""
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, event, func, inspect, or_, select, union_all
+from sqlalchemy.orm import Session, object_session
+
+from .extensions import db, upsert_insert
+from .models import Appointment, AppointmentCounter, AppointmentStatus, ArchivedAppointment
+
+# (hospital_id, day, doctor_id)
+Key = Tuple[int, date, int]
+# (hospital_id, day, doctor_id, status) of one appointment
+Slot = Tuple[int, date, int, AppointmentStatus]
+
+COLUMNS = {status: status.name.lower() for status in AppointmentStatus}
+
+
+def moved(session: Session, old: Optional[Slot], new: Optional[Slot]) -> None:
+    """Count an appointment leaving ``old`` and entering ``new`` (either may be None) on commit."""
+    if old == new:
+        return
+    deltas = session.info.setdefault("stat_deltas", defaultdict(int))
+    if old is not None:
+        deltas[old] -= 1
+    if new is not None:
+        deltas[new] += 1
+
+
+def _slot(target, previous: bool) -> Slot:
+    attrs = inspect(target).attrs
+    values = []
+    for name in ("hospital_id", "date", "doctor_id", "status"):
+        deleted = attrs[name].history.deleted if previous else ()
+        values.append(deleted[0] if deleted else getattr(target, name))
+    return tuple(values)
+
+
+def _count_insert(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        moved(session, None, _slot(target, previous=False))
+
+
+def _count_update(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        moved(session, _slot(target, previous=True), _slot(target, previous=False))
+
+
+def _count_delete(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        moved(session, _slot(target, previous=True), None)
+
+
+event.listen(Appointment, "after_insert", _count_insert)
+event.listen(Appointment, "after_update", _count_update)
+event.listen(Appointment, "after_delete", _count_delete)
+
+
+def add(session: Session, increments: Dict[Key, Dict[str, int]]) -> None:
+    """Add per-column increments to the counter rows, creating missing rows."""
+    table = AppointmentCounter.__table__
+    # Key order keeps concurrent writers from deadlocking on the row locks
+    for (hospital_id, day, doctor_id), columns in sorted(increments.items()):
+        stmt = upsert_insert(session, AppointmentCounter).values(
+            hospital_id=hospital_id, day=day, doctor_id=doctor_id,
+            **{c: columns.get(c, 0) for c in COLUMNS.values()},
+        )
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.hospital_id, table.c.day, table.c.doctor_id],
+            set_={c: table.c[c] + stmt.excluded[c] for c in columns},
+        ))
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_before_commit(session) -> None:
+    if session.in_nested_transaction():
+        return
+    session.flush()
+    deltas = session.info.pop("stat_deltas", None)
+    if not deltas:
+        return
+    increments: Dict[Key, Dict[str, int]] = defaultdict(dict)
+    for (hospital_id, day, doctor_id, status), n in deltas.items():
+        if n:
+            increments[(hospital_id, day, doctor_id)][COLUMNS[status]] = n
+    add(session, increments)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop("stat_deltas", None)
+
+
+def hospital_day(hospital_id: int, day: date) -> List[AppointmentCounter]:
+    """Counter rows of one hospital and day, one per doctor with appointments."""
+    return AppointmentCounter.query.filter_by(hospital_id=hospital_id, day=day).order_by(
+        AppointmentCounter.doctor_id
+    ).all()
+
+
+def reconcile(since: Optional[date] = None) -> int:
+    """Correct counters for days from ``since`` (all days if None); return rows corrected.
+
+    Truth and counters are read in one statement, i.e. one snapshot, and
+    the difference is added as an increment, so writes committing meanwhile
+    are neither lost nor counted twice. The caller commits.
+    """
+    parts = []
+    for model in (Appointment, ArchivedAppointment):
+        q = select(
+            model.hospital_id, model.date.label("day"), model.doctor_id,
+            *(func.sum(case((model.status == status, 1), else_=0)).label(c) for status, c in COLUMNS.items()),
+        ).group_by(model.hospital_id, model.date, model.doctor_id)
+        parts.append(q.where(model.date >= since) if since is not None else q)
+    stored = select(
+        AppointmentCounter.hospital_id, AppointmentCounter.day, AppointmentCounter.doctor_id,
+        *((-getattr(AppointmentCounter, c)).label(c) for c in COLUMNS.values()),
+    )
+    parts.append(stored.where(AppointmentCounter.day >= since) if since is not None else stored)
+
+    both = union_all(*parts).subquery()
+    sums = [func.sum(both.c[c]) for c in COLUMNS.values()]
+    drift = db.session.execute(
+        select(both.c.hospital_id, both.c.day, both.c.doctor_id, *(s.label(c) for s, c in zip(sums, COLUMNS.values())))
+        .group_by(both.c.hospital_id, both.c.day, both.c.doctor_id)
+        .having(or_(*(s != 0 for s in sums)))
+    ).all()
+    add(db.session, {
+        (row.hospital_id, row.day, row.doctor_id): {c: getattr(row, c) for c in COLUMNS.values() if getattr(row, c)}
+        for row in drift
+    })
+
+    empty = delete(AppointmentCounter).where(*(getattr(AppointmentCounter, c) == 0 for c in COLUMNS.values()))
+    db.session.execute(empty.where(AppointmentCounter.day >= since) if since is not None else empty)
+    return len(drift)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Multi-threaded booking benchmark.
+
+Spawns concurrent patients that all try to book the same small pool of
+slots through POST /api/appointments, then checks the database for double
+bookings. Uses a throwaway SQLite file unless DATABASE_URL is set.
+
+    python bench_booking.py --threads 16 --attempts 200 --slots 24
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, time as time_cls, timedelta
+
+
+def run(threads: int, attempts: int, slots: int) -> None:
+    if not os.getenv("DATABASE_URL"):
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import func
+    from backend import create_app
+    from backend.extensions import db
+    from backend.migrations import upgrade
+    from backend.models import (
+        Appointment, AppointmentStatus, Doctor, DoctorSchedule, Hospital, User, UserType,
+    )
+
+    app = create_app()
+
+    day = date.today() + timedelta(days=1)
+    with app.app_context():
+        upgrade()
+        hospital = Hospital(name="Bench Hospital", address="Bench Street", latitude=18.52, longitude=73.85)
+        doctor_user = User(email=f"bench-doctor-{time.time()}@example.com", password_hash="x",
+                           user_type=UserType.DOCTOR)
+        db.session.add_all([hospital, doctor_user])
+        db.session.flush()
+        doctor = Doctor(user_id=doctor_user.user_id, hospital_id=hospital.hospital_id, specialization="General")
+        db.session.add(doctor)
+        db.session.flush()
+        db.session.add(DoctorSchedule(doctor_id=doctor.doctor_id, day_of_week=day.weekday(),
+                                      start_time=time_cls(0, 0), end_time=time_cls(23, 59)))
+        patients = [User(email=f"bench-patient-{i}-{time.time()}@example.com", password_hash="x",
+                         user_type=UserType.PATIENT) for i in range(threads)]
+        db.session.add_all(patients)
+        db.session.commit()
+        doctor_id, hospital_id = doctor.doctor_id, hospital.hospital_id
+        tokens = [create_access_token(identity={"user_id": p.user_id, "user_type": "Patient"}) for p in patients]
+
+    slot_times = [f"{9 + i // 4:02d}:{(i % 4) * 15:02d}" for i in range(slots)]
+    counts = {"booked": 0, "conflict": 0, "error": 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads)
+
+    def patient(token: str) -> None:
+        client = app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        local = {"booked": 0, "conflict": 0, "error": 0}
+        start_gate.wait()
+        for _ in range(attempts):
+            r = client.post("/api/appointments", headers=headers, json={
+                "doctor_id": doctor_id, "hospital_id": hospital_id,
+                "date": day.isoformat(), "time": random.choice(slot_times),
+            })
+            key = "booked" if r.status_code == 201 else "conflict" if r.status_code == 409 else "error"
+            local[key] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    workers = [threading.Thread(target=patient, args=(t,)) for t in tokens]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        duplicates = db.session.query(Appointment.time, func.count()).filter(
+            Appointment.doctor_id == doctor_id,
+            Appointment.date == day,
+            Appointment.status != AppointmentStatus.CANCELLED,
+        ).group_by(Appointment.time).having(func.count() > 1).all()
+
+    total = threads * attempts
+    print(f"{threads} threads x {attempts} attempts over {slots} slots in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} req/s)")
+    print(f"booked={counts['booked']} conflict={counts['conflict']} error={counts['error']}")
+    print(f"double-booked slots: {len(duplicates)}")
+    if duplicates or counts["booked"] > slots:
+        raise SystemExit("FAILED: a slot was booked more than once")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--attempts", type=int, default=100)
+    parser.add_argument("--slots", type=int, default=24)
+    args = parser.parse_args()
+    run(args.threads, args.attempts, args.slots)
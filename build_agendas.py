@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Materialize every doctor's daily agenda for the coming AGENDA_DAYS_AHEAD days
+and drop agendas of past days. Safe to re-run; schedule it nightly.
+
+    python build_agendas.py [--days 2] [--batch-size 500]
+"""
+
+import argparse
+from datetime import date
+
+from backend import create_app
+from backend.agenda import build_days, purge_before
+
+
+def main() -> None:
+    app = create_app()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=app.config["AGENDA_DAYS_AHEAD"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    today = date.today()
+    with app.app_context():
+        purged = purge_before(today)
+        built = build_days(today, args.days, args.batch_size)
+    print(f"Built {built} agendas for {args.days} days from {today}, dropped {purged} past ones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Check that the hot queries of the API are answered from indexes.
+
+Runs EXPLAIN on each query used by the request handlers and exits non-zero
+if any of them falls back to a full table scan or a separate sort step (a
+temporary B-tree for ORDER BY, GROUP BY or DISTINCT). Uses a throwaway SQLite database unless DATABASE_URL is
+set; on PostgreSQL sequential scans are disabled for the check so the
+planner's choice on tiny tables doesn't mask a missing index.
+
+    python check_query_plans.py
+"""
+
+import json
+import os
+import tempfile
+from datetime import date, time
+
+
+def hot_queries():
+    from backend.extensions import db
+    from backend.models import Appointment, AppointmentChange, AppointmentCounter, AppointmentStatus, ArchivedAppointment, Doctor, DoctorAgenda, DoctorSchedule, HospitalAdmin, User
+
+    today = date.today()
+    by_slot = (Appointment.date.asc(), Appointment.time.asc())
+    return {
+        "schedule windows (is_slot_available, slots.load_windows)":
+            DoctorSchedule.query.filter_by(doctor_id=1, day_of_week=today.weekday()),
+        "occupancy rebuild (slots.load_booked)":
+            db.session.query(Appointment.date, Appointment.time).filter(
+                Appointment.doctor_id == 1,
+                Appointment.date >= today,
+                Appointment.date <= today,
+                Appointment.status != AppointmentStatus.CANCELLED,
+            ),
+        "booked slot confirmation (slots.occupancy.confirm_booked)":
+            Appointment.query.filter(
+                Appointment.doctor_id == 1,
+                Appointment.date == today,
+                Appointment.time == time(9),
+                Appointment.status != AppointmentStatus.CANCELLED,
+            ),
+        "occupancy feed sync (changes.days_changed_since)":
+            db.session.query(AppointmentChange.seq, AppointmentChange.changed_at, Appointment.doctor_id, Appointment.date)
+            .join(Appointment, Appointment.appointment_id == AppointmentChange.appointment_id)
+            .filter(AppointmentChange.seq > 100),
+        "doctor appointments (list_user_appointments)":
+            Appointment.query.filter_by(doctor_id=1).order_by(*by_slot),
+        "doctor appointments today (list_user_appointments?today=true)":
+            Appointment.query.filter_by(doctor_id=1).filter(Appointment.date == today).order_by(*by_slot),
+        "doctor history page (list_user_appointments?limit=&cursor=&order=desc)":
+            Appointment.query.filter_by(doctor_id=1)
+            .filter(db.tuple_(Appointment.date, Appointment.time, Appointment.appointment_id) < (today, time(12), 1))
+            .order_by(Appointment.date.desc(), Appointment.time.desc(), Appointment.appointment_id.desc())
+            .limit(51),
+        "archived doctor history page (list_user_appointments)":
+            ArchivedAppointment.query.filter_by(doctor_id=1)
+            .filter(db.tuple_(ArchivedAppointment.date, ArchivedAppointment.time, ArchivedAppointment.appointment_id)
+                    < (today, time(12), 1))
+            .order_by(ArchivedAppointment.date.desc(), ArchivedAppointment.time.desc(),
+                      ArchivedAppointment.appointment_id.desc())
+            .limit(51),
+        "doctor agenda (agenda.agendas.get)":
+            DoctorAgenda.query.filter_by(doctor_id=1, day=today),
+        "agenda rebuild (agenda.rebuild)":
+            db.session.query(Appointment).filter(Appointment.doctor_id.in_([1, 2]), Appointment.date.in_([today])),
+        "hospital day counters (get_hospital_stats)":
+            AppointmentCounter.query.filter_by(hospital_id=1, day=today).order_by(AppointmentCounter.doctor_id),
+        "doctor status counts (count_user_appointments)":
+            db.session.query(*(db.func.sum(db.case((Appointment.status == s, 1), else_=0)) for s in AppointmentStatus))
+            .filter(Appointment.doctor_id == 1),
+        "patient appointments (list_user_appointments)":
+            Appointment.query.filter_by(patient_id=1).order_by(*by_slot),
+        "doctor change feed (appointment_changes)":
+            db.session.query(AppointmentChange.seq, Appointment)
+            .join(Appointment, Appointment.appointment_id == AppointmentChange.appointment_id)
+            .filter(AppointmentChange.seq > 100, AppointmentChange.doctor_id == 1)
+            .order_by(AppointmentChange.seq).limit(501),
+        "doctor by user (list_user_appointments, get_profile)":
+            Doctor.query.filter_by(user_id=1),
+        "doctors by hospital (doctors_by_hospital, get_doctors)":
+            Doctor.query.filter_by(hospital_id=1),
+        "available doctors by specialization (nearby_hospitals)":
+            Doctor.query.filter(Doctor.is_available.is_(True), db.func.lower(Doctor.specialization) == "cardiology"),
+        "hospital admin by user (hospital_admin routes)":
+            HospitalAdmin.query.filter_by(user_id=1),
+        "user by email (login, register)":
+            User.query.filter_by(email="someone@example.com"),
+    }
+
+
+def _sqlite_problems(db, sql: str):
+    plan = db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)).all()
+    details = [row[-1] for row in plan]
+    return [d for d in details if d.startswith("SCAN ") or "TEMP B-TREE" in d], details
+
+
+def _postgres_problems(db, sql: str):
+    db.session.execute(db.text("SET LOCAL enable_seqscan = off"))
+    plan = db.session.execute(db.text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node["Node Type"] + (f" on {node['Relation Name']}" if "Relation Name" in node else ""))
+        stack.extend(node.get("Plans", []))
+    return [n for n in nodes if n.startswith("Seq Scan") or n == "Sort"], nodes
+
+
+def main() -> int:
+    if not os.getenv("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+
+    from backend import create_app
+    from backend.extensions import db
+    from backend.migrations import upgrade
+
+    app = create_app()
+    failed = 0
+    with app.app_context():
+        upgrade()
+        explain = _postgres_problems if db.engine.dialect.name == "postgresql" else _sqlite_problems
+        for name, query in hot_queries().items():
+            sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+            problems, plan = explain(db, sql)
+            print(f"{'FAIL' if problems else 'ok  '} {name}")
+            for step in plan:
+                print(f"       {step}")
+            failed += bool(problems)
+            db.session.rollback()
+    print(f"\n{failed} hot quer{'y' if failed == 1 else 'ies'} without an index path")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
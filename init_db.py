@@ -11,9 +11,10 @@ def init_database():
     app = create_app()
     
     with app.app_context():
-        # Create all tables
+        # Create all tables and upgrade existing ones in place
         from backend.extensions import db
-        db.create_all()
+        from backend.migrations import upgrade
+        upgrade()
         print("Database tables created successfully!")
         
         # Add sample hospitals if none exist
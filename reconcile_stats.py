@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Correct the hospital dashboard counters against the appointments of the last
+STATS_RECONCILE_DAYS days and all upcoming ones. Safe to re-run; schedule it hourly.
+
+    python reconcile_stats.py [--days 7] [--all]
+"""
+
+import argparse
+from datetime import date, timedelta
+
+from backend import create_app
+from backend.extensions import db
+from backend.stats import reconcile
+
+
+def main() -> None:
+    app = create_app()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=app.config["STATS_RECONCILE_DAYS"])
+    parser.add_argument("--all", action="store_true", help="check every day, including archived ones")
+    args = parser.parse_args()
+
+    since = None if args.all else date.today() - timedelta(days=args.days)
+    with app.app_context():
+        corrected = reconcile(since)
+        db.session.commit()
+    print(f"Corrected {corrected} counter rows" + ("" if since is None else f" from {since}"))
+
+
+if __name__ == "__main__":
+    main()